@@ -0,0 +1,253 @@
+"""Batch autosolver for Cribbage Solitaire decks.
+
+Plays every deck given, in deck files (in the format of
+final_partA.load_deck) or corpus files (see cribbage_corpus), with the
+autosolver of final_partC1, several decks at a time in worker
+processes, and prints one JSON record per deck as soon as it is done
+(in the order the decks were given):
+{"deck": <file>, "score": <points>, "win": <true if points >= 61>,
+ "moves": [<column indices>], "nodes": <positions searched>,
+ "seconds": <wall time>}
+Decks from a corpus also have "index": <index of the deck in it>.
+A deck file which can't be loaded gets {"deck": <file>, "error": <why>}.
+A deck found in the solution store (see store=<file>) gets
+"stored": true, with the nodes of the search which found it and the
+seconds taken to look it up.
+
+Ties between equally good moves are broken with a seed made from the
+deck (see CribbageSolitaire.choose), so a deck always gets the same
+record, however the decks are split between workers or runs.
+
+Calling:
+python3 cribbage_batch.py <depth> <deck file or directory>... [prune]
+                          [reuse] [workers=<n>] [store=<file>]
+                          [tt-mb=<n>]
+<depth>: as for final_partC1.py: a number of moves to look ahead,
+"exact", or a time budget per move such as "500ms"
+<deck file or directory>: deck files or corpus files, or directories
+whose files all are
+prune, reuse: as for final_partC1.py
+workers=<n>: solve n decks at a time, in n processes (default 1)
+store=<file>: as for final_partC1.py: look decks up in the solution
+store in file first, and save the ones solved there
+tt-mb=<n>: as for final_partC1.py, in each worker process
+
+Example: python3 cribbage_batch.py 6 decks/ prune workers=8 > out.jsonl
+"""
+
+import functools
+import json
+import os
+
+from final_partC1 import *
+from cribbage_corpus import *
+
+
+# Point total needed to win (see CribbageSolitaire.win_or_lose).
+WIN_POINTS = 61
+
+
+# Corpus files and solution stores opened by this process (file name ->
+# DeckCorpus or SolutionStore).
+open_corpora = {}
+open_stores = {}
+
+
+def deck_sources(paths):
+    """Return a list of where to find each deck named by paths (deck
+    files, corpus files, or directories of them): a 2-tuple of the file
+    name and the index of the deck in the corpus, or None for a deck
+    file.
+
+    Every corpus is checked here, so the workers don't check it again.
+    """
+
+    sources = []
+
+    for filename in deck_files(paths):
+        if os.path.isfile(filename) and is_corpus(filename):
+            with DeckCorpus(filename) as corpus:
+                sources += [(filename, i) for i in range(len(corpus))]
+        else:
+            sources.append((filename, None))
+
+    return sources
+
+
+def load_source(source):
+    """Return the deck found at source (see deck_sources)."""
+
+    filename, index = source
+
+    if index is None:
+        return load_deck(filename)
+
+    if filename not in open_corpora:
+        open_corpora[filename] = DeckCorpus(filename, validate=False)
+    return open_corpora[filename][index]
+
+
+def play_deck(deck, depth, time_budget=None, prune=False, reuse=False,
+              tt_megabytes=None):
+    """Autoplay deck (a list of ranks) without printing anything, and
+    return the 'score', 'win', 'moves' and 'nodes' of its record (see
+    the module docstring), as a dict.
+
+    tt_megabytes is as for RecursiveCribbageSolitaire.__init__, and
+    the other arguments are those of RecursiveCribbageSolitaire.autoplay.
+    """
+
+    game = RecursiveCribbageSolitaire(deck=deck, verbosity=SILENT,
+                                      tie_seed=' '.join(deck),
+                                      tt_megabytes=tt_megabytes)
+    points = game.autoplay(depth, prune=prune, time_budget=time_budget,
+                           reuse=reuse)
+
+    return {'score': points, 'win': points >= WIN_POINTS,
+            'moves': game.moves_played(), 'nodes': game.game_nodes}
+
+
+def solve_deck(source, depth, time_budget, prune, reuse, store=None,
+               tt_megabytes=None):
+    """Autoplay the deck found at source (see deck_sources) without
+    printing anything, and return its record (see the module
+    docstring).
+
+    If store is not None, the deck is looked up in the solution store
+    file store first, and saved there if it had to be solved.
+    tt_megabytes is as for RecursiveCribbageSolitaire.__init__.
+
+    The other arguments are those of RecursiveCribbageSolitaire.autoplay.
+    """
+
+    start = time.perf_counter()
+    record = {'deck': source[0]}
+    if source[1] is not None:
+        record['index'] = source[1]
+
+    # A file which isn't text raises a ValueError (UnicodeDecodeError)
+    try:
+        deck = load_source(source)
+    except (OSError, ValueError, InvalidDeck) as e:
+        record['error'] = str(e)
+        return record
+
+    settings = None
+    if store is not None:
+        if store not in open_stores:
+            open_stores[store] = SolutionStore(store)
+        settings = solver_settings(depth, time_budget, prune, reuse)
+
+    if settings is not None:
+        solution = open_stores[store].get(deck, settings)
+        if solution is not None:
+            record['score'] = solution['score']
+            record['win'] = solution['score'] >= WIN_POINTS
+            record['moves'] = solution['moves']
+            record['nodes'] = solution['stats']['nodes']
+            record['seconds'] = round(time.perf_counter() - start, 6)
+            record['stored'] = True
+            return record
+
+    record.update(play_deck(deck, depth, time_budget, prune, reuse,
+                            tt_megabytes))
+    record['seconds'] = round(time.perf_counter() - start, 4)
+
+    if settings is not None:
+        open_stores[store].put(deck, settings, record['score'],
+                               record['moves'],
+                               {'nodes': record['nodes'],
+                                'seconds': record['seconds']})
+
+    return record
+
+
+def solve_decks(sources, depth, time_budget=None, prune=False,
+                reuse=False, workers=1, store=None, tt_megabytes=None):
+    """Yield the records of the decks found at sources (see
+    deck_sources and solve_deck), in order, solving `workers` decks at
+    a time in worker processes."""
+
+    solve = functools.partial(solve_deck, depth=depth,
+                              time_budget=time_budget, prune=prune,
+                              reuse=reuse, store=store,
+                              tt_megabytes=tt_megabytes)
+
+    if workers == 1:
+        for source in sources:
+            yield solve(source)
+        return
+
+    # Send the decks to the workers a few at a time, but with enough
+    # chunks per worker that the slow decks even out
+    chunksize = max(1, min(64, len(sources) // (workers * 8)))
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        yield from pool.map(solve, sources, chunksize=chunksize)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    options = [arg for arg in args[1:]
+               if arg in [PRUNE, REUSE]
+               or arg.startswith((WORKERS, STORE, TT_MB))]
+    paths = [arg for arg in args[1:] if arg not in options]
+
+    if not paths:
+        print("Error: Expected a depth and at least one deck file or"
+              f" directory, optionally followed by '{PRUNE}', '{REUSE}',"
+              f" '{WORKERS}<n>', '{STORE}<file>' and/or '{TT_MB}<n>',"
+              f" got {args}.")
+        quit(1)
+
+    try:
+        depth, time_budget = parse_depth(args[0])
+    except ValueError as e:
+        print(f"Entered depth caused an error: {e}")
+        quit(1)
+
+    workers = 1
+    store = None
+    tt_megabytes = None
+
+    for option in options:
+        if option.startswith(WORKERS):
+            try:
+                workers = int(option[len(WORKERS):])
+            except ValueError as e:
+                print(f"Entered number of workers caused an error: {e}")
+                quit(1)
+        elif option.startswith(STORE):
+            store = option[len(STORE):]
+        elif option.startswith(TT_MB):
+            try:
+                tt_megabytes = float(option[len(TT_MB):])
+            except ValueError as e:
+                print(f"Entered table size caused an error: {e}")
+                quit(1)
+
+    if workers < 1:
+        raise TypeError(f"Expected workers >= 1, got {workers}.")
+
+    if tt_megabytes is not None and tt_megabytes <= 0:
+        raise TypeError(f"Expected a table size > 0, got {tt_megabytes}.")
+
+    try:
+        sources = deck_sources(paths)
+    except (OSError, ValueError, InvalidCorpus, InvalidDeck) as e:
+        print(f"Reading the corpus caused an error: {e}")
+        quit(1)
+
+    if store is not None:
+        # Make the store here, so the workers don't all try to
+        try:
+            SolutionStore(store).close()
+        except sqlite3.Error as e:
+            print(f"Entered solution store caused an error: {e}")
+            quit(1)
+
+    for record in solve_decks(sources, depth, time_budget,
+                              PRUNE in options, REUSE in options, workers,
+                              store, tt_megabytes):
+        print(json.dumps(record), flush=True)
@@ -0,0 +1,338 @@
+"""Benchmarks for the hot paths of Cribbage Solitaire.
+
+Times the functions the autosolvers spend their time in, on the same
+fixed, seeded stacks and games every run:
+- evaluate: re-scores the whole stack
+- evaluate_last: looks only at the top of the stack
+- evaluate_tail: one lookup in the precomputed tail table
+- is_straight, same_ranks: on the top 3-5 cards of the stacks
+- legal_moves, make_undo (make_move then undo_move) and best_moves
+  (the greedy one move look ahead) of CribbageSolitaire: on games
+  played part of the way with random moves
+
+For each one it reports, per call:
+- the nanoseconds
+- the peak bytes allocated above what was in use before the call (as
+  traced by tracemalloc), so garbage made by a change shows up even
+  when it is freed again
+- the memory blocks still allocated after the call (the change in
+  sys.getallocatedblocks), e.g. new cache entries or objects leaked
+
+Python has no count of every allocation a call makes (blocks freed
+again before it returns aren't counted anywhere), so the peak bytes
+stand in for the garbage made, and the blocks count what is kept.
+
+Calling:
+python3 cribbage_bench.py [<number of stacks>] [out=<file>]
+                          [baseline=<file>] [threshold=<percent>]
+<number of stacks>: how many stacks to time (default 10000), and a
+tenth as many games
+out=<file>: save the results as JSON to file
+baseline=<file>: compare with the results saved in file, and exit with
+status 1 if any benchmark is more than threshold percent slower
+threshold=<percent>: see baseline (default 10)
+"""
+
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from final_partB import *
+
+
+# Seed of the random stacks and games, so every run times the same
+# ones.
+FIXTURE_SEED = 1
+
+# Optional arguments: the file to save results to, the file of results
+# to compare with, and how much slower (percent) is a regression.
+OUT = 'out='
+BASELINE = 'baseline='
+THRESHOLD = 'threshold='
+DEFAULT_THRESHOLD = 10
+
+
+def scoring_fixtures(size, seed=FIXTURE_SEED):
+    """Return `size` stacks that can happen in a game, each as a
+    4-tuple of (stack, count, packed tail before the last card,
+    last card).
+
+    The stacks are the stacks of games played by picking cards at
+    random, so they have the usual mix of lengths.
+    """
+
+    rng = random.Random(seed)
+    fixtures = []
+
+    while len(fixtures) < size:
+        deck = valid_ranks * 4
+        rng.shuffle(deck)
+        stack = []
+        count = 0
+
+        for card in deck:
+            if count + rank_count[card] > 31:
+                stack = []
+                count = 0
+            tail = pack_tail(stack)
+            stack.append(card)
+            count += rank_count[card]
+            fixtures.append((stack[:], count, tail, card))
+
+            if len(fixtures) == size:
+                break
+
+    return fixtures
+
+
+def game_fixtures(size, seed=FIXTURE_SEED):
+    """Return `size` games (without output or files) of seeded decks,
+    each played a random number of random moves in, and left where
+    there is a legal move.
+
+    Return value: a list of 2-tuples of the game and its legal moves
+    """
+
+    rng = random.Random(seed)
+    fixtures = []
+
+    for i in range(size):
+        game = CribbageSolitaire(deck=stream_deck(seed, i), verbosity=SILENT)
+
+        for _ in range(rng.randrange(40)):
+            moves = game.legal_moves()
+            if not moves:
+                game.new_stack()
+                moves = game.legal_moves()
+            game.make_move(rng.choice(moves))
+
+        if not game.legal_moves():
+            game.new_stack()
+        fixtures.append((game, game.legal_moves()))
+
+    return fixtures
+
+
+def time_per_call(function, arguments, repeat=7):
+    """Return the fastest time, in nanoseconds, of calling function
+    once on each argument tuple in `arguments`, divided by the number
+    of calls.
+
+    Like timeit, the garbage collector is off while timing, so it
+    doesn't add noise.
+    """
+
+    best = None
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for args in arguments:
+                function(*args)
+            elapsed = time.perf_counter() - start
+
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    return best / len(arguments) * 1e9
+
+
+def bytes_per_call(function, arguments):
+    """Return the mean peak memory, in bytes, allocated by one call of
+    function on an argument tuple of `arguments` (see the module
+    docstring)."""
+
+    total = 0
+
+    tracemalloc.start()
+    for args in arguments:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        function(*args)
+        total += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    return total / len(arguments)
+
+
+def blocks_per_call(function, arguments):
+    """Return the mean number of memory blocks (Python objects and
+    other allocations) left allocated by one call of function on an
+    argument tuple of `arguments`, from sys.getallocatedblocks.
+
+    The garbage collector is off, so it doesn't free blocks of earlier
+    calls part way, and the blocks counted when calling a function
+    which does nothing are taken off.
+    """
+
+    def count_blocks(function):
+        total = 0
+        for args in arguments:
+            before = sys.getallocatedblocks()
+            function(*args)
+            total += sys.getallocatedblocks() - before
+        return total
+
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        total = count_blocks(function) - count_blocks(lambda *args: None)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    return total / len(arguments)
+
+
+def make_undo(game, move):
+    """Make a move, then undo it."""
+
+    game.make_move(move)
+    game.undo_move()
+
+
+def benchmark_cases(size=10000):
+    """Return a dict from benchmark name to a 2-tuple of the function
+    it times and the argument tuples to call it on."""
+
+    stacks = scoring_fixtures(size)
+    games = game_fixtures(max(1, size // 10))
+
+    return {
+        'evaluate': (
+            evaluate, [(stack,) for stack, _, _, _ in stacks]),
+        'evaluate_last': (
+            evaluate_last, [(stack, count) for stack, count, _, _ in stacks]),
+        'evaluate_tail': (
+            evaluate_tail,
+            [(tail, card, count) for _, count, tail, card in stacks]),
+        'is_straight': (
+            is_straight, [(stack[-(3 + i % 3):],)
+                          for i, (stack, _, _, _) in enumerate(stacks)]),
+        'same_ranks': (
+            same_ranks, [(stack[-(2 + i % 3):],)
+                         for i, (stack, _, _, _) in enumerate(stacks)]),
+        'legal_moves': (
+            CribbageSolitaire.legal_moves, [(game,) for game, _ in games]),
+        'make_undo': (
+            make_undo, [(game, moves[i % len(moves)])
+                        for i, (game, moves) in enumerate(games)]),
+        'best_moves': (
+            CribbageSolitaire.best_moves, games),
+    }
+
+
+def run_benchmarks(size=10000, rounds=7):
+    """Run every benchmark (see benchmark_cases).
+
+    The benchmarks take turns, `rounds` times, and the fastest round of
+    each one counts, so a slow spell of the machine doesn't land on
+    just one of them.
+
+    Return value: a dict from benchmark name to a dict of its
+    'ns_per_op', peak 'bytes_per_op', 'blocks_per_op' kept and number
+    of calls 'ops'
+    """
+
+    cases = benchmark_cases(size)
+    fastest = {}
+
+    for _ in range(rounds):
+        for name, (function, arguments) in cases.items():
+            nanoseconds = time_per_call(function, arguments, repeat=1)
+            fastest[name] = min(nanoseconds, fastest.get(name, nanoseconds))
+
+    results = {}
+
+    for name, (function, arguments) in cases.items():
+        results[name] = {
+            'ns_per_op': round(fastest[name], 1),
+            'bytes_per_op': round(bytes_per_call(function, arguments), 1),
+            'blocks_per_op': round(blocks_per_call(function, arguments), 2),
+            'ops': len(arguments),
+        }
+
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Return the names of the benchmarks in both results and baseline
+    which are more than threshold percent slower in results."""
+
+    return [name for name in results if name in baseline
+            and results[name]['ns_per_op']
+            > baseline[name]['ns_per_op'] * (1 + threshold / 100)]
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    size = 10000
+    out = baseline_file = None
+    threshold = DEFAULT_THRESHOLD
+
+    try:
+        for arg in args:
+            if arg.startswith(OUT):
+                out = arg[len(OUT):]
+            elif arg.startswith(BASELINE):
+                baseline_file = arg[len(BASELINE):]
+            elif arg.startswith(THRESHOLD):
+                threshold = float(arg[len(THRESHOLD):])
+            else:
+                size = int(arg)
+    except ValueError as e:
+        print(f"Entered arguments {args} caused an error: {e}")
+        quit(1)
+
+    baseline = None
+    if baseline_file is not None:
+        try:
+            with open(baseline_file) as file:
+                saved = json.load(file)
+            baseline = saved['results']
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Entered baseline file caused an error: {e}")
+            quit(1)
+
+        if saved.get('size') != size:
+            print(f"Warning: the baseline timed {saved.get('size')} stacks,"
+                  f" not {size}.")
+
+    results = run_benchmarks(size)
+
+    print(f"{'benchmark':<16s}{'ns/op':>10s}{'peak B/op':>11s}"
+          f"{'blocks/op':>11s}"
+          + (f"{'baseline':>10s}{'change':>9s}" if baseline else ''))
+    for name, result in results.items():
+        line = (f"{name:<16s}{result['ns_per_op']:>10.0f}"
+                f"{result['bytes_per_op']:>11.0f}"
+                f"{result['blocks_per_op']:>11.2f}")
+        if baseline and name in baseline:
+            before = baseline[name]['ns_per_op']
+            line += (f"{before:>10.0f}"
+                     f"{(result['ns_per_op'] / before - 1) * 100:>+8.1f}%")
+        print(line)
+
+    if out is not None:
+        with open(out, 'w') as file:
+            json.dump({'python': platform.python_version(), 'size': size,
+                       'results': results}, file, indent=2)
+            file.write('\n')
+
+    if baseline is not None:
+        slower = compare(results, baseline, threshold)
+        if slower:
+            print(f"Slower than the baseline by over {threshold}%:"
+                  f" {', '.join(slower)}")
+            quit(1)
@@ -0,0 +1,309 @@
+"""Binary corpus files of Cribbage Solitaire decks.
+
+A corpus holds any number of decks in one file, so large experiments
+don't need one text file (see final_partA.save_deck) per deck.  The
+file is a 12 byte header followed by the decks:
+- header: CORPUS_MAGIC, the format version and DECK_BYTES (2 bytes
+  each, little endian), and the number of decks (4 bytes)
+- each deck: its 52 ranks in order, as rank orders (1-13) packed two
+  to a byte, the first of each pair in the high 4 bits (26 bytes)
+
+DeckCorpus reads a corpus through mmap, so deck i is read straight from
+the file without reading the ones before it, and checks every deck
+when it is opened.
+
+Calling:
+python3 cribbage_corpus.py pack <corpus> <deck file or directory>...
+    Write the decks in the text deck files to a new corpus file.
+python3 cribbage_corpus.py stream <corpus> <stream> <number of decks>
+    Write the first decks of a seeded deck stream (see
+    final_partA.stream_deck) to a new corpus file.
+python3 cribbage_corpus.py unpack <corpus> <directory>
+    Write every deck of the corpus to a text deck file in directory.
+python3 cribbage_corpus.py check <corpus>
+    Check every deck of the corpus and print the number of decks.
+"""
+
+import mmap
+import os
+import struct
+import sys
+
+from final_partA import *
+
+
+# First bytes of a corpus file, and the version of the format.
+CORPUS_MAGIC = b'CSDK'
+CORPUS_VERSION = 1
+
+# Layout of the header (magic, version, deck size, number of decks).
+HEADER_FORMAT = '<4sHHI'
+HEADER_BYTES = struct.calcsize(HEADER_FORMAT)
+
+# Bytes of one packed deck.
+DECK_BYTES = DECK_NUM // 2
+
+# Rank of each 4-bit rank order.
+order_rank = {order: rank for rank, order in rank_order.items()}
+
+# Both ranks of each byte of a packed deck (or None for a byte which
+# isn't two rank orders).
+byte_ranks = [(order_rank[byte >> 4], order_rank[byte & 0xf])
+              if byte >> 4 in order_rank and byte & 0xf in order_rank
+              else None
+              for byte in range(256)]
+
+# Cards of each rank in each byte, as a sum of one 6-bit field per rank
+# (rank order r in bits 6r to 6r + 5).  A byte which isn't two rank
+# orders sets a bit above all the fields instead.  A deck is valid if
+# the sum over its 26 bytes is VALID_DECK_SUM: 4 cards of every rank.
+INVALID_BYTE = 1 << 6 * 14
+byte_sums = [INVALID_BYTE if ranks is None
+             else sum(1 << 6 * rank_order[rank] for rank in ranks)
+             for ranks in byte_ranks]
+VALID_DECK_SUM = sum(4 << 6 * order for order in rank_order.values())
+
+
+class InvalidCorpus(Exception):
+    """Exception class raised when a file is not a valid corpus."""
+
+    pass
+
+
+def pack_deck(deck):
+    """Return the 26 bytes of the (valid) deck `deck` in a corpus."""
+
+    return bytes(rank_order[deck[i]] << 4 | rank_order[deck[i + 1]]
+                 for i in range(0, DECK_NUM, 2))
+
+
+def unpack_deck(data):
+    """Return the deck (a list of ranks) packed in the bytes data.
+
+    Raises InvalidDeck if a byte of data isn't two rank orders.
+    """
+
+    deck = []
+
+    for byte in data:
+        ranks = byte_ranks[byte]
+        if ranks is None:
+            raise InvalidDeck(f"Invalid packed ranks in byte {byte:#04x}.")
+        deck += ranks
+
+    return deck
+
+
+def write_corpus(filename, decks):
+    """Write the decks (lists of ranks) to a new corpus file, checking
+    each one with validate_deck.
+
+    Return value: the number of decks written
+    """
+
+    number = 0
+
+    with open(filename, 'wb') as file:
+        # Write a header for 0 decks first, and fix it at the end
+        file.write(struct.pack(HEADER_FORMAT, CORPUS_MAGIC, CORPUS_VERSION,
+                               DECK_BYTES, 0))
+
+        for deck in decks:
+            validate_deck(deck)
+            file.write(pack_deck(deck))
+            number += 1
+
+        file.seek(0)
+        file.write(struct.pack(HEADER_FORMAT, CORPUS_MAGIC, CORPUS_VERSION,
+                               DECK_BYTES, number))
+
+    return number
+
+
+def is_corpus(filename):
+    """Return `True` if the file filename starts like a corpus file."""
+
+    with open(filename, 'rb') as file:
+        return file.read(len(CORPUS_MAGIC)) == CORPUS_MAGIC
+
+
+class DeckCorpus:
+    """The decks of a corpus file, read through mmap.
+
+    Deck i is corpus[i] (a list of ranks), len(corpus) is the number of
+    decks, and iterating gives every deck in order.  Every deck is
+    checked when the corpus is opened (see `validate`).
+    """
+
+    def __init__(self, filename, validate=True):
+        """Open the corpus file filename.
+
+        Raises InvalidCorpus if the file is not a corpus, and
+        InvalidDeck if validate is `True` and a deck is invalid.
+        """
+
+        self.filename = filename
+
+        with open(filename, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size < HEADER_BYTES:
+                raise InvalidCorpus(f"{filename} is too short for a corpus.")
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, deck_bytes, self.size = struct.unpack_from(
+            HEADER_FORMAT, self.data)
+
+        try:
+            if magic != CORPUS_MAGIC:
+                raise InvalidCorpus(f"{filename} is not a corpus file.")
+            if version != CORPUS_VERSION or deck_bytes != DECK_BYTES:
+                raise InvalidCorpus(
+                    f"{filename} has corpus version {version} with"
+                    f" {deck_bytes} bytes per deck, expected version"
+                    f" {CORPUS_VERSION} with {DECK_BYTES}.")
+            if size != HEADER_BYTES + self.size * DECK_BYTES:
+                raise InvalidCorpus(f"{filename} should hold {self.size}"
+                                    f" decks but is {size} bytes long.")
+
+            if validate:
+                self.validate()
+        except (InvalidCorpus, InvalidDeck):
+            self.close()
+            raise
+
+    def __len__(self):
+        """Return the number of decks in the corpus."""
+        return self.size
+
+    def __getitem__(self, i):
+        """Return deck i of the corpus (a list of ranks)."""
+
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError(f"Deck {i} is not in a corpus of {self.size}.")
+
+        start = HEADER_BYTES + i * DECK_BYTES
+        return unpack_deck(self.data[start:start + DECK_BYTES])
+
+    def __iter__(self):
+        """Iterate over the decks of the corpus."""
+
+        for i in range(self.size):
+            yield self[i]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the corpus file."""
+        self.data.close()
+
+    def validate(self):
+        """Check every deck of the corpus in one pass over the file.
+
+        Each byte is looked up in byte_sums, and each deck's bytes
+        must add up to VALID_DECK_SUM, so there is no per-rank
+        counting.  Raises InvalidDeck naming the first invalid deck.
+        """
+
+        sums = byte_sums.__getitem__
+        data = self.data
+
+        for i in range(self.size):
+            start = HEADER_BYTES + i * DECK_BYTES
+            if sum(map(sums, data[start:start + DECK_BYTES])) \
+                    != VALID_DECK_SUM:
+                # Find out what is wrong with it for the error message
+                try:
+                    validate_deck(unpack_deck(data[start:start + DECK_BYTES]))
+                except InvalidDeck as e:
+                    raise InvalidDeck(f"Deck {i} of {self.filename}: {e}")
+                raise InvalidDeck(f"Deck {i} of {self.filename} is invalid.")
+
+
+def deck_files(paths):
+    """Return the files named by paths: each path itself, or the files
+    in it (sorted by name) if it is a directory."""
+
+    files = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if os.path.isfile(os.path.join(path, name)):
+                    files.append(os.path.join(path, name))
+        else:
+            files.append(path)
+
+    return files
+
+
+def text_to_corpus(corpus_filename, deck_filenames):
+    """Write the decks in the text deck files deck_filenames (see
+    load_deck) to a new corpus file, and return how many there are."""
+
+    return write_corpus(corpus_filename,
+                        (load_deck(filename) for filename in deck_filenames))
+
+
+def corpus_to_text(corpus_filename, directory):
+    """Write every deck of a corpus to a text deck file (see save_deck)
+    in directory, named by its index, and return how many there are."""
+
+    os.makedirs(directory, exist_ok=True)
+
+    with DeckCorpus(corpus_filename) as corpus:
+        digits = len(str(max(len(corpus) - 1, 0)))
+        for i, deck in enumerate(corpus):
+            save_deck(deck, os.path.join(directory, f'deck{i:0{digits}d}'))
+
+        return len(corpus)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    if len(args) >= 3 and args[0] == 'pack':
+        try:
+            number = text_to_corpus(args[1], deck_files(args[2:]))
+        except (OSError, ValueError, InvalidDeck) as e:
+            print(f"Packing the decks caused an error: {e}")
+            quit(1)
+        print(f"Wrote {number} decks to {args[1]}.")
+
+    elif len(args) == 4 and args[0] == 'stream':
+        try:
+            stream = int(args[2])
+            number = int(args[3])
+        except ValueError as e:
+            print(f"Entered stream or number of decks caused an error: {e}")
+            quit(1)
+
+        write_corpus(args[1], (stream_deck(stream, i) for i in range(number)))
+        print(f"Wrote {number} decks to {args[1]}.")
+
+    elif len(args) == 3 and args[0] == 'unpack':
+        try:
+            number = corpus_to_text(args[1], args[2])
+        except (OSError, InvalidCorpus, InvalidDeck) as e:
+            print(f"Unpacking the corpus caused an error: {e}")
+            quit(1)
+        print(f"Wrote {number} decks to {args[2]}.")
+
+    elif len(args) == 2 and args[0] == 'check':
+        try:
+            with DeckCorpus(args[1]) as corpus:
+                print(f"{args[1]}: {len(corpus)} valid decks.")
+        except (OSError, InvalidCorpus, InvalidDeck) as e:
+            print(f"Checking the corpus caused an error: {e}")
+            quit(1)
+
+    else:
+        print("Error: Expected 'pack <corpus> <deck file or directory>...',"
+              " 'stream <corpus> <stream> <number of decks>', 'unpack"
+              f" <corpus> <directory>' or 'check <corpus>', got {args}.")
+        quit(1)
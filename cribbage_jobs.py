@@ -0,0 +1,240 @@
+"""Long running, restartable solves of many Cribbage Solitaire decks.
+
+Like cribbage_batch, but for runs which take hours: the decks are split
+into shards of a fixed number of decks, worker processes solve one
+shard at a time, and every finished shard is saved in the job
+directory, so a run which is stopped or crashes can be started again
+with the same command and only solves the shards which aren't done.
+
+The job directory holds:
+- checkpoint.json: what the job is (depth, decks, options, shard size)
+  and which shards are done
+- shard<k>.jsonl: the records (see cribbage_batch) of the decks of
+  shard k, in order
+- results.jsonl: the records of every deck, in order, once all the
+  shards are done
+
+Every file is written to a temporary file first and then renamed, so
+a crash never leaves a half written shard or checkpoint behind.
+
+While it runs, a line of progress (decks done, decks per minute and
+the time left) is printed after every shard.
+
+Calling:
+python3 cribbage_jobs.py <job directory> <depth> <deck file or directory>...
+                         [prune] [reuse] [workers=<n>] [shard=<n>]
+                         [tt-mb=<n>]
+<job directory>: where to keep the job (made if it doesn't exist)
+<depth>, <deck file or directory>, prune, reuse, workers=<n>,
+tt-mb=<n>: as for cribbage_batch.py
+shard=<n>: the number of decks in a shard (default 20)
+"""
+
+import json
+
+from cribbage_batch import *
+
+
+# Optional argument giving the number of decks in a shard.
+SHARD = 'shard='
+DEFAULT_SHARD = 20
+
+# Files of a job directory.
+CHECKPOINT_FILE = 'checkpoint.json'
+RESULTS_FILE = 'results.jsonl'
+
+
+class JobMismatch(Exception):
+    """Exception class raised when a job directory holds another job."""
+
+    pass
+
+
+def write_atomic(filename, text):
+    """Write text to the file filename, so that the file has either
+    its old contents or all of text, even if the program crashes."""
+
+    temporary = filename + '.tmp'
+
+    with open(temporary, 'w') as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(temporary, filename)
+
+
+def shard_file(directory, shard):
+    """Return the name of the file of shard number `shard`."""
+    return os.path.join(directory, f'shard{shard}.jsonl')
+
+
+def load_checkpoint(directory, job):
+    """Return the set of shards done in the job directory, or an empty
+    set for a new job.
+
+    Raises JobMismatch if the directory holds a different job (a dict
+    of what the job is, see run_job).
+    """
+
+    try:
+        with open(os.path.join(directory, CHECKPOINT_FILE)) as file:
+            checkpoint = json.load(file)
+    except FileNotFoundError:
+        return set()
+
+    if checkpoint['job'] != job:
+        raise JobMismatch(f"{directory} holds the job {checkpoint['job']},"
+                          f" not {job}.")
+
+    # A shard only counts as done if its file was written too
+    return {shard for shard in checkpoint['done']
+            if os.path.exists(shard_file(directory, shard))}
+
+
+def save_checkpoint(directory, job, done):
+    """Save the job (see run_job) and the set of shards done."""
+
+    write_atomic(os.path.join(directory, CHECKPOINT_FILE),
+                 json.dumps({'job': job, 'done': sorted(done)}, indent=2))
+
+
+def solve_shard(sources, depth, time_budget, prune, reuse,
+                tt_megabytes=None):
+    """Solve every deck found at sources (see deck_sources), and return
+    the list of their records (see solve_deck)."""
+
+    return [solve_deck(source, depth, time_budget, prune, reuse,
+                       tt_megabytes=tt_megabytes)
+            for source in sources]
+
+
+def format_seconds(seconds):
+    """Return a number of seconds as hours:minutes:seconds."""
+
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}'
+
+
+def run_job(directory, depth_arg, paths, prune=False, reuse=False,
+            workers=1, shard_size=DEFAULT_SHARD, tt_megabytes=None):
+    """Solve the decks named by paths in shards, skipping the shards
+    already done in the job directory, and write the results (see the
+    module docstring).
+
+    Arguments:
+    - directory: the job directory
+    - depth_arg: the <depth> argument (see parse_depth)
+    - paths: deck files, corpus files or directories of them
+    - prune, reuse: as for RecursiveCribbageSolitaire.autoplay
+    - workers: the number of shards to solve at a time, in processes
+    - shard_size: the number of decks in a shard
+    - tt_megabytes: as for RecursiveCribbageSolitaire.__init__ (it
+      doesn't change the results, so it isn't part of the job)
+
+    Return value: the number of decks solved by this run
+
+    Raises JobMismatch if the directory holds a different job.
+    """
+
+    depth, time_budget = parse_depth(depth_arg)
+    sources = deck_sources(paths)
+    shards = [sources[i:i + shard_size]
+              for i in range(0, len(sources), shard_size)]
+
+    job = {'depth': depth_arg, 'paths': paths, 'decks': len(sources),
+           'prune': prune, 'reuse': reuse, 'shard_size': shard_size}
+
+    os.makedirs(directory, exist_ok=True)
+    done = load_checkpoint(directory, job)
+    to_do = [shard for shard in range(len(shards)) if shard not in done]
+
+    decks_left = sum(len(shards[shard]) for shard in to_do)
+    print(f"{len(sources)} decks in {len(shards)} shards, {len(done)} done"
+          " already.", flush=True)
+
+    start = time.perf_counter()
+    decks_solved = 0
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(solve_shard, shards[shard], depth,
+                               time_budget, prune, reuse,
+                               tt_megabytes): shard
+                   for shard in to_do}
+
+        for future in concurrent.futures.as_completed(futures):
+            shard = futures[future]
+            records = future.result()
+
+            write_atomic(shard_file(directory, shard), ''.join(
+                json.dumps(record) + '\n' for record in records))
+            done.add(shard)
+            save_checkpoint(directory, job, done)
+
+            decks_solved += len(records)
+            minutes = (time.perf_counter() - start) / 60
+            rate = decks_solved / minutes
+            eta = (decks_left - decks_solved) / rate * 60
+            print(f"Shard {shard} done: {len(done)}/{len(shards)} shards,"
+                  f" {decks_solved}/{decks_left} decks this run,"
+                  f" {rate:.1f} decks/min, ETA {format_seconds(eta)}",
+                  flush=True)
+
+    # Put the shards together in order
+    results = []
+    for shard in range(len(shards)):
+        with open(shard_file(directory, shard)) as file:
+            results.append(file.read())
+    write_atomic(os.path.join(directory, RESULTS_FILE), ''.join(results))
+
+    return decks_solved
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    options = [arg for arg in args[2:] if arg in [PRUNE, REUSE]
+               or arg.startswith((WORKERS, SHARD, TT_MB))]
+    paths = [arg for arg in args[2:] if arg not in options]
+
+    if not paths:
+        print("Error: Expected a job directory, a depth and at least one"
+              f" deck file or directory, optionally followed by '{PRUNE}',"
+              f" '{REUSE}', '{WORKERS}<n>', '{SHARD}<n>' and/or"
+              f" '{TT_MB}<n>', got {args}.")
+        quit(1)
+
+    workers = 1
+    shard_size = DEFAULT_SHARD
+    tt_megabytes = None
+
+    try:
+        parse_depth(args[1])
+        for option in options:
+            if option.startswith(WORKERS):
+                workers = int(option[len(WORKERS):])
+            elif option.startswith(SHARD):
+                shard_size = int(option[len(SHARD):])
+            elif option.startswith(TT_MB):
+                tt_megabytes = float(option[len(TT_MB):])
+    except ValueError as e:
+        print(f"Entered arguments {args[1:]} caused an error: {e}")
+        quit(1)
+
+    if workers < 1 or shard_size < 1:
+        raise TypeError(f"Expected workers and shard size >= 1, got"
+                        f" {workers} and {shard_size}.")
+
+    if tt_megabytes is not None and tt_megabytes <= 0:
+        raise TypeError(f"Expected a table size > 0, got {tt_megabytes}.")
+
+    try:
+        run_job(args[0], args[1], paths, PRUNE in options, REUSE in options,
+                workers, shard_size, tt_megabytes)
+    except (OSError, ValueError, InvalidCorpus, InvalidDeck,
+            JobMismatch) as e:
+        print(f"Running the job caused an error: {e}")
+        quit(1)
+
+    print(f"Done: results in {os.path.join(args[0], RESULTS_FILE)}.")
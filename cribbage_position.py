@@ -0,0 +1,216 @@
+"""Compact positions of a Cribbage Solitaire game.
+
+The deck never changes during a game, so everything about a position
+that matters for the rest of the game fits in one int:
+- the heights of the four columns (4 bits each, bits 0-15), which say
+  which cards are left
+- the count of the stack (bits 16-20)
+- the packed tail (see final_partA.pack_tail) of the part of the stack
+  that can still score (see final_partA.live_tail), from bit 21 on
+
+Positions with the same int have the same future points, so solvers
+can use them as keys, and send them to other processes instead of the
+columns and stack.
+
+Which column holds which cards doesn't matter for scoring either, so
+canonical_position also gives positions whose columns are the same up
+to order (or hold the same ranks) the same int.
+"""
+
+import itertools
+
+from final_partA import *
+
+
+# Bit offsets of the fields of a position.
+HEIGHT_BITS = 4
+COUNT_SHIFT = 16
+TAIL_SHIFT = 21
+
+# Bits of a position holding the column heights.
+HEIGHTS_MASK = (1 << COUNT_SHIFT) - 1
+
+# Bits of a subtree key (see subtree_key) holding the moves looked
+# ahead.
+DEPTH_BITS = 6
+
+# Stack part (count and live tail) of a position, looked up from the
+# packed tail of the whole stack and the count (see stack_state).
+stack_states = {}
+
+
+def pack_position(heights, count, tail):
+    """Return the position with column heights `heights`, stack count
+    `count` and packed stack tail `tail`.
+
+    The tail is stored as is, so it should only hold the part of the
+    stack which can still score (see stack_state).
+    """
+
+    position = count << COUNT_SHIFT | tail << TAIL_SHIFT
+    for col in range(4):
+        position |= heights[col] << HEIGHT_BITS * col
+
+    return position
+
+
+def unpack_position(position):
+    """Return a 3-tuple of the column heights (a list), the count and
+    the packed stack tail of a position (see pack_position)."""
+
+    heights = [position >> HEIGHT_BITS * col & 0xf for col in range(4)]
+    count = position >> COUNT_SHIFT & 0x1f
+    tail = position >> TAIL_SHIFT
+
+    return heights, count, tail
+
+
+def cards_left(position):
+    """Return the number of cards left in the columns of a position."""
+
+    return sum(position >> HEIGHT_BITS * col & 0xf for col in range(4))
+
+
+def subtree_key(position, moves_left):
+    """Return the key of the search of moves_left moves ahead from a
+    position (at most 63 bits)."""
+
+    return position << DEPTH_BITS | moves_left
+
+
+def subtree_depth(key):
+    """Return the moves looked ahead by the search with key `key` (see
+    subtree_key)."""
+
+    return key & (1 << DEPTH_BITS) - 1
+
+
+def stack_state(tail, count):
+    """Return the stack part of a position (its bits from COUNT_SHIFT
+    on) for a stack with packed tail `tail` and count `count`.
+
+    Only the part of the tail which can still score is kept, so stacks
+    whose deeper cards can't score any more share a position.
+    """
+
+    key = tail << 5 | count
+    state = stack_states.get(key)
+
+    if state is None:
+        live = pack_tail(live_tail(unpack_tail(tail), count))
+        state = stack_states[key] = count | live << TAIL_SHIFT - COUNT_SHIFT
+
+    return state
+
+
+def move_position(position, col, count, tail):
+    """Return the position after playing the bottom card of column
+    `col`.
+
+    Arguments:
+    - position: the position before the move
+    - col: the column index of the move
+    - count: the count of the stack after the move
+    - tail: the packed tail of the whole stack after the move
+    """
+
+    state = stack_state(tail, count)
+    return (position & HEIGHTS_MASK) - (1 << HEIGHT_BITS * col) \
+        | state << COUNT_SHIFT
+
+
+def clear_position(position):
+    """Return the position after starting a new stack."""
+
+    return position & HEIGHTS_MASK
+
+
+def column_contents(cols):
+    """Return content ids of every column of a deck at every height,
+    as a list of 4 lists: column -> height -> id.
+
+    Columns with the same ranks left (bottom to top of the layout)
+    get the same id, whichever column they are, and an empty column
+    has id 0.
+
+    Arguments:
+    - cols: the full columns of the deck (13 ranks each)
+    """
+
+    ids = {(): 0}
+    contents = []
+
+    for col in cols:
+        col_ids = []
+        for height in range(len(col) + 1):
+            left = tuple(col[:height])
+            col_ids.append(ids.setdefault(left, len(ids)))
+        contents.append(col_ids)
+
+    return contents
+
+
+def shared_contents(contents):
+    """Return the set of content ids (see column_contents) which more
+    than one column can have left, apart from the empty column.
+
+    Only positions with such a content left can have a canonical
+    position other than themselves (see canonical_heights), and most
+    decks have few of them.
+    """
+
+    columns = {}
+    for col in range(4):
+        for content in contents[col][1:]:
+            columns.setdefault(content, set()).add(col)
+
+    return {content for content, cols in columns.items() if len(cols) > 1}
+
+
+def canonical_heights(heights, contents):
+    """Return the height bits of the canonical position of a position
+    with height bits `heights`.
+
+    Positions whose columns hold the same cards in a different order
+    have the same future points.  Of all column heights which leave
+    the same content ids (see column_contents) in some order, the one
+    with the fewest cards in column 0 (then column 1, ...) is
+    canonical.
+    """
+
+    left = [contents[col][heights >> HEIGHT_BITS * col & 0xf]
+            for col in range(4)]
+    best = None
+
+    # Every way of giving the contents left to the columns which can
+    # hold them
+    for order in itertools.permutations(left):
+        try:
+            candidate = tuple(contents[col].index(order[col])
+                              for col in range(4))
+        except ValueError:
+            continue
+        if best is None or candidate < best:
+            best = candidate
+
+    return pack_position(best, 0, EMPTY_TAIL)
+
+
+def canonical_position(position, contents, canonical):
+    """Return the canonical position of `position`: the same position
+    with the cards left in the columns moved so that the column heights
+    are canonical (see canonical_heights).
+
+    canonical is a dict from height bits to canonical height bits for
+    the deck, which the heights are looked up in first and added to,
+    so each is only worked out once.
+    """
+
+    heights = position & HEIGHTS_MASK
+    canonical_bits = canonical.get(heights)
+
+    if canonical_bits is None:
+        canonical_bits = canonical[heights] = canonical_heights(
+            heights, contents)
+
+    return position - heights + canonical_bits
@@ -0,0 +1,565 @@
+"""Solving Cribbage Solitaire decks on several machines over TCP.
+
+A coordinator holds the decks (deck files or corpus files, as for
+cribbage_batch) and hands them out one at a time to the workers which
+connect to it, which may run on any machine that can reach it.  Each
+worker solves its deck with the autosolver of final_partC1 and sends
+back the record (see cribbage_batch), which the coordinator prints as
+soon as it gets it, with "id": <the deck's place in the decks given>.
+
+A deck handed to a worker is leased to it: if the worker's connection
+drops (e.g. the process dies), or it doesn't send the record within
+the lease time (e.g. its machine is off the network), the deck is
+handed to another worker.  A record which comes in after its deck was
+handed out again is still used if it is the first, and any later one
+for the same deck is dropped.  The lease time has to be longer than
+the slowest deck takes to solve.
+
+With out=<file>, the records are also appended to that file, and a
+coordinator started again with the same file only hands out the decks
+which aren't in it yet.
+
+Workers get the ranks of the deck with it, so they don't need the deck
+files.  Every message is one line of JSON (a dict with an "op"):
+- worker to coordinator: {"op": "lease"} asks for a deck, and
+  {"op": "result", "id": <id>, "record": <record>} returns one
+- coordinator to worker, in answer to "lease": {"op": "solve", "id",
+  "deck", "depth", "prune", "reuse"}, {"op": "wait", "seconds"} when
+  every deck left is leased, or {"op": "done"} when all are solved
+
+There is no authentication: only listen on a trusted network.
+
+Calling:
+python3 cribbage_queue.py serve <port> <depth> <deck file or directory>...
+                                [prune] [reuse] [host=<address>]
+                                [lease=<seconds>] [out=<file>]
+python3 cribbage_queue.py work <host>:<port> [workers=<n>] [tt-mb=<n>]
+serve: run the coordinator on port <port>
+<depth>, <deck file or directory>, prune, reuse: as for cribbage_batch.py
+host=<address>: the address to listen on (default 127.0.0.1, only
+this machine; 0.0.0.0 for all)
+lease=<seconds>: the lease time (default 600)
+out=<file>: append the records to file (see above)
+work: run workers which solve decks for the coordinator at <host>:<port>
+until every deck is solved
+workers=<n>: run n workers, in n processes (default 1)
+tt-mb=<n>: as for final_partC1.py, in each worker
+
+Example, on one machine:
+python3 cribbage_queue.py serve 5050 6 decks/ prune out=out.jsonl
+python3 cribbage_queue.py work 127.0.0.1:5050 workers=4
+"""
+
+import collections
+import socket
+import socketserver
+import threading
+
+from cribbage_batch import *
+
+
+# Commands.
+SERVE = 'serve'
+WORK = 'work'
+
+# Optional arguments giving the address to listen on, the lease time
+# and the file to append the records to.
+HOST = 'host='
+LEASE = 'lease='
+OUT = 'out='
+
+# Defaults of those arguments.
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_LEASE = 600
+
+# Seconds a worker waits before asking again when every deck left is
+# leased.
+WAIT_SECONDS = 1
+
+# Seconds the coordinator waits for the workers to disconnect once
+# every deck is solved.
+GRACE_SECONDS = 3 * WAIT_SECONDS
+
+
+class ProtocolError(Exception):
+    """Exception class raised when a message isn't one of the protocol
+    (see the module docstring)."""
+
+    pass
+
+
+def send_message(file, message):
+    """Send message (a dict) as a line of JSON to the file of a
+    socket."""
+
+    file.write(json.dumps(message) + '\n')
+    file.flush()
+
+
+def receive_message(file):
+    """Return the next message (a dict) from the file of a socket, or
+    None if the connection was closed.
+
+    Raises ProtocolError if the line isn't a message.
+    """
+
+    line = file.readline()
+    if not line:
+        return None
+
+    try:
+        message = json.loads(line)
+    except ValueError as e:
+        raise ProtocolError(f"Expected a line of JSON, got {line!r}: {e}")
+
+    if not isinstance(message, dict) or 'op' not in message:
+        raise ProtocolError(f"Expected a dict with an 'op', got {message}.")
+
+    return message
+
+
+class WorkQueue:
+    """The decks of a coordinator, and which are leased or solved (see
+    the module docstring). Safe to use from several threads."""
+
+    def __init__(self, sources, lease_seconds=DEFAULT_LEASE, solved=()):
+        """Make a queue of every deck found at sources (see
+        deck_sources) except the ids (indices in sources) in
+        solved."""
+
+        self.sources = sources
+        self.lease_seconds = lease_seconds
+        self.solved = {i for i in solved if 0 <= i < len(sources)}
+        self.pending = collections.deque(
+            i for i in range(len(sources)) if i not in self.solved)
+
+        # Leased ids -> (time the lease ends, worker it is leased to)
+        self.leases = {}
+
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        if len(self.solved) == len(sources):
+            self.finished.set()
+
+    def reclaim(self):
+        """Put the decks whose lease ended back at the front of the
+        queue. Called with the lock held."""
+
+        now = time.monotonic()
+        for i, (deadline, worker) in list(self.leases.items()):
+            if deadline < now:
+                del self.leases[i]
+                self.pending.appendleft(i)
+
+    def lease(self, worker):
+        """Lease the next deck to worker (any object standing for it).
+
+        Return value: its id, or None if every deck left is leased
+        """
+
+        with self.lock:
+            self.reclaim()
+            if not self.pending:
+                return None
+
+            i = self.pending.popleft()
+            self.leases[i] = (time.monotonic() + self.lease_seconds, worker)
+            return i
+
+    def release(self, worker):
+        """Put the decks leased to worker (e.g. when its connection
+        drops) back at the front of the queue."""
+
+        with self.lock:
+            for i, (deadline, leased_to) in list(self.leases.items()):
+                if leased_to is worker:
+                    del self.leases[i]
+                    self.pending.appendleft(i)
+
+    def complete(self, i):
+        """Mark deck i solved.
+
+        Return value: `True` if it wasn't solved before (so its record
+        is the first)
+        """
+
+        with self.lock:
+            if i in self.solved:
+                return False
+
+            self.solved.add(i)
+            self.leases.pop(i, None)
+            if i in self.pending:
+                self.pending.remove(i)
+
+            if len(self.solved) == len(self.sources):
+                self.finished.set()
+            return True
+
+
+class Coordinator(socketserver.ThreadingTCPServer):
+    """TCP server handing out the decks of a WorkQueue to workers, and
+    writing the records they send back (see the module docstring)."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, queue, depth_arg, prune=False, reuse=False,
+                 out=None):
+        """Listen on address (a 2-tuple of host and port).
+
+        Arguments:
+        - queue: the WorkQueue of the decks
+        - depth_arg: the <depth> argument (see parse_depth), sent to
+          the workers
+        - prune, reuse: as for RecursiveCribbageSolitaire.autoplay
+        - out: a file open for appending to write the records to too,
+          or None
+        """
+
+        socketserver.ThreadingTCPServer.__init__(self, address, WorkerHandler)
+
+        self.queue = queue
+        self.depth_arg = depth_arg
+        self.prune = prune
+        self.reuse = reuse
+        self.out = out
+        self.output_lock = threading.Lock()
+
+        # Handlers of the workers connected
+        self.workers = set()
+        self.workers_lock = threading.Lock()
+
+    def connected(self, handler, is_connected):
+        """Note that the worker of handler connected or disconnected."""
+
+        with self.workers_lock:
+            if is_connected:
+                self.workers.add(handler)
+            else:
+                self.workers.discard(handler)
+
+    def wait_for_workers(self, seconds):
+        """Wait until no workers are connected (they disconnect when
+        told they are done), for at most seconds."""
+
+        end = time.monotonic() + seconds
+        while self.workers and time.monotonic() < end:
+            time.sleep(0.05)
+
+    def next_job(self, worker):
+        """Return the answer to a "lease" message from worker."""
+
+        while True:
+            i = self.queue.lease(worker)
+            if i is None:
+                if self.queue.finished.is_set():
+                    return {'op': 'done'}
+                return {'op': 'wait', 'seconds': WAIT_SECONDS}
+
+            source = self.queue.sources[i]
+            try:
+                deck = load_source(source)
+            except (OSError, ValueError, InvalidDeck) as e:
+                # Nothing for a worker to do (e.g. the file isn't a
+                # deck, or not even text): record it and lease the
+                # next deck
+                self.record(i, {'error': str(e)})
+                continue
+
+            return {'op': 'solve', 'id': i, 'deck': deck,
+                    'depth': self.depth_arg, 'prune': self.prune,
+                    'reuse': self.reuse}
+
+    def record(self, i, fields):
+        """Write the record of deck i, made from the fields a worker
+        sent, unless deck i was already solved."""
+
+        if not self.queue.complete(i):
+            return
+
+        filename, index = self.queue.sources[i]
+        record = {'id': i, 'deck': filename}
+        if index is not None:
+            record['index'] = index
+        record.update(fields)
+
+        line = json.dumps(record) + '\n'
+        with self.output_lock:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+            if self.out is not None:
+                self.out.write(line)
+                self.out.flush()
+
+
+class WorkerHandler(socketserver.BaseRequestHandler):
+    """Handler of the connection of one worker to a Coordinator."""
+
+    def handle(self):
+        coordinator = self.server
+        coordinator.connected(self, True)
+
+        # Ids of the decks handed to this worker: the only records it
+        # may send
+        handed = set()
+
+        try:
+            with self.request.makefile('rw') as file:
+                while True:
+                    message = receive_message(file)
+                    if message is None:
+                        break
+
+                    if message['op'] == 'lease':
+                        answer = coordinator.next_job(self)
+                        if answer['op'] == 'solve':
+                            handed.add(answer['id'])
+                        send_message(file, answer)
+                        if answer['op'] == 'done':
+                            break
+                    elif message['op'] == 'result':
+                        i = message['id']
+                        if i not in handed:
+                            raise ProtocolError(
+                                f"Deck {i!r} wasn't handed to this worker.")
+                        if not isinstance(message['record'], dict):
+                            raise ProtocolError(
+                                "Expected a dict as the record, got"
+                                f" {message['record']!r}.")
+                        coordinator.record(i, message['record'])
+                    else:
+                        raise ProtocolError(f"Unknown op {message['op']!r}.")
+        except (OSError, ProtocolError, KeyError, ValueError) as e:
+            print(f"Worker {self.client_address} caused an error: {e}",
+                  file=sys.stderr, flush=True)
+        finally:
+            # Whatever it was solving goes to another worker
+            coordinator.queue.release(self)
+            coordinator.connected(self, False)
+
+
+def read_solved(filename):
+    """Return the set of ids of the records in the file filename (see
+    out=<file>), or an empty set if it doesn't exist.
+
+    A last line which isn't a whole record (the coordinator stopped
+    while writing it) is cut off the file, so the records appended
+    next start on a line of their own, and its deck is solved again.
+
+    Raises ValueError if any other line isn't a record.
+    """
+
+    solved = set()
+
+    try:
+        with open(filename, 'rb+') as file:
+            lines = file.readlines()
+            end = 0
+
+            for n, line in enumerate(lines):
+                if not line.endswith(b'\n') and n == len(lines) - 1:
+                    file.truncate(end)
+                    break
+
+                try:
+                    if line.strip():
+                        solved.add(int(json.loads(line)['id']))
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError(f"Line {n + 1} of {filename} isn't a"
+                                     f" record: {e}")
+                end += len(line)
+    except FileNotFoundError:
+        pass
+
+    return solved
+
+
+def serve(port, depth_arg, paths, prune=False, reuse=False,
+          host=DEFAULT_HOST, lease_seconds=DEFAULT_LEASE, out=None):
+    """Run a coordinator until every deck named by paths is solved (see
+    the module docstring).
+
+    Arguments:
+    - port, host: the address to listen on
+    - depth_arg: the <depth> argument (see parse_depth)
+    - paths: deck files, corpus files or directories of them
+    - prune, reuse: as for RecursiveCribbageSolitaire.autoplay
+    - lease_seconds: the lease time
+    - out: the name of a file to append the records to too, or None
+
+    Return value: the number of decks solved by this run
+    """
+
+    parse_depth(depth_arg)
+    sources = deck_sources(paths)
+    solved = read_solved(out) if out is not None else set()
+    queue = WorkQueue(sources, lease_seconds, solved)
+    solved_before = len(queue.solved)
+
+    print(f"{len(sources)} decks, {solved_before} solved already."
+          f" Listening on {host}:{port}.", file=sys.stderr, flush=True)
+
+    out_file = open(out, 'a') if out is not None else None
+    try:
+        with Coordinator((host, port), queue, depth_arg, prune, reuse,
+                         out_file) as coordinator:
+            thread = threading.Thread(target=coordinator.serve_forever)
+            thread.start()
+            queue.finished.wait()
+            # Let the waiting workers ask once more, to be told they
+            # are done
+            coordinator.wait_for_workers(GRACE_SECONDS)
+            coordinator.shutdown()
+            thread.join()
+    finally:
+        if out_file is not None:
+            out_file.close()
+
+    return len(queue.solved) - solved_before
+
+
+def work(address, tt_megabytes=None):
+    """Solve decks for the coordinator at address (a 2-tuple of host
+    and port) until it has none left.
+
+    Return value: the number of decks solved
+
+    Raises OSError if the connection fails, and ProtocolError if the
+    coordinator sends something which isn't a message or closes the
+    connection without saying every deck is solved.
+    """
+
+    solved = 0
+
+    with socket.create_connection(address) as connection, \
+            connection.makefile('rw') as file:
+        while True:
+            send_message(file, {'op': 'lease'})
+            message = receive_message(file)
+
+            if message is None:
+                raise ProtocolError("The coordinator closed the connection"
+                                    " before every deck was solved.")
+
+            if message['op'] == 'done':
+                return solved
+
+            if message['op'] == 'wait':
+                time.sleep(message['seconds'])
+                continue
+
+            if message['op'] != 'solve':
+                raise ProtocolError(f"Unknown op {message['op']!r}.")
+
+            start = time.perf_counter()
+            depth, time_budget = parse_depth(message['depth'])
+            record = play_deck(message['deck'], depth, time_budget,
+                               message['prune'], message['reuse'],
+                               tt_megabytes)
+            record['seconds'] = round(time.perf_counter() - start, 4)
+
+            send_message(file, {'op': 'result', 'id': message['id'],
+                                'record': record})
+            solved += 1
+
+
+def run_workers(address, workers=1, tt_megabytes=None):
+    """Run `workers` workers (see `work`) in processes, and return the
+    number of decks they solved."""
+
+    if workers == 1:
+        return work(address, tt_megabytes)
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(work, address, tt_megabytes)
+                   for _ in range(workers)]
+        return sum(future.result() for future in futures)
+
+
+def parse_address(arg):
+    """Return the address in the <host>:<port> argument arg, as a
+    2-tuple of host and port.
+
+    Raises ValueError if arg isn't an address.
+    """
+
+    host, colon, port = arg.rpartition(':')
+    if not colon or not host:
+        raise ValueError(f"Expected <host>:<port>, got {arg!r}.")
+
+    return host, int(port)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    if len(args) >= 4 and args[0] == SERVE:
+        options = [arg for arg in args[3:] if arg in [PRUNE, REUSE]
+                   or arg.startswith((HOST, LEASE, OUT))]
+        paths = [arg for arg in args[3:] if arg not in options]
+    elif len(args) >= 2 and args[0] == WORK:
+        options = args[2:]
+        paths = []
+    else:
+        options = paths = None
+
+    if options is None or (args[0] == SERVE and not paths):
+        print(f"Error: Expected '{SERVE} <port> <depth> <deck file or"
+              f" directory>...' or '{WORK} <host>:<port>', optionally"
+              " followed by options (see the module docstring), got"
+              f" {args}.")
+        quit(1)
+
+    host = DEFAULT_HOST
+    lease_seconds = DEFAULT_LEASE
+    out = None
+    workers = 1
+    tt_megabytes = None
+
+    try:
+        for option in options:
+            if args[0] == SERVE and option.startswith(HOST):
+                host = option[len(HOST):]
+            elif args[0] == SERVE and option.startswith(LEASE):
+                lease_seconds = float(option[len(LEASE):])
+            elif args[0] == SERVE and option.startswith(OUT):
+                out = option[len(OUT):]
+            elif args[0] == WORK and option.startswith(WORKERS):
+                workers = int(option[len(WORKERS):])
+            elif args[0] == WORK and option.startswith(TT_MB):
+                tt_megabytes = float(option[len(TT_MB):])
+            elif option not in [PRUNE, REUSE]:
+                raise ValueError(f"Unknown option {option!r}.")
+
+        if args[0] == SERVE:
+            port = int(args[1])
+            parse_depth(args[2])
+        else:
+            address = parse_address(args[1])
+    except ValueError as e:
+        print(f"Entered arguments {args[1:]} caused an error: {e}")
+        quit(1)
+
+    if lease_seconds <= 0 or workers < 1:
+        raise TypeError(f"Expected a lease time > 0 and workers >= 1, got"
+                        f" {lease_seconds} and {workers}.")
+
+    if tt_megabytes is not None and tt_megabytes <= 0:
+        raise TypeError(f"Expected a table size > 0, got {tt_megabytes}.")
+
+    if args[0] == SERVE:
+        try:
+            solved = serve(port, args[2], paths, PRUNE in options,
+                           REUSE in options, host, lease_seconds, out)
+        except (OSError, ValueError, InvalidCorpus, InvalidDeck) as e:
+            print(f"Running the coordinator caused an error: {e}")
+            quit(1)
+        print(f"Done: {solved} decks solved.", file=sys.stderr)
+    else:
+        try:
+            solved = run_workers(address, workers, tt_megabytes)
+        except (OSError, ProtocolError) as e:
+            print(f"Running the workers caused an error: {e}")
+            quit(1)
+        print(f"Done: {solved} decks solved.")
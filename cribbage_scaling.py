@@ -0,0 +1,150 @@
+"""Scaling benchmark of the Cribbage Solitaire autosolver.
+
+Plays the same seeded decks (see final_partA.stream_deck) with
+RecursiveCribbageSolitaire.autoplay looking 1, 2, ... max depth moves
+ahead, and optionally solving exactly, to show how much each extra
+move of look ahead costs and how many points it gains.  Each depth is
+run in a new process, so its peak memory is its own.
+
+For each depth it reports:
+- mean final score, and how many of the decks were won
+- time to choose a move: median, 90th and 99th percentile, and max
+- positions searched in all, and per second
+- peak resident memory of the process (RSS)
+
+and prints them as a table, and optionally writes them as CSV.
+
+Calling:
+python3 cribbage_scaling.py <max depth> [exact] [prune] [reuse]
+                            [decks=<n>] [stream=<s>] [csv=<file>]
+<max depth>: the deepest look ahead to run
+exact: also solve every deck exactly (slow)
+prune, reuse: as for final_partC1.py
+decks=<n>: play the first n decks of the stream (default 5)
+stream=<s>: the seeded deck stream to play (default 0)
+csv=<file>: also write the results to file as CSV
+"""
+
+import csv
+import resource
+
+from final_partC1 import *
+
+
+# Optional arguments giving the number of decks, the deck stream and
+# the CSV file.
+DECKS = 'decks='
+STREAM = 'stream='
+CSV = 'csv='
+
+# Columns of the results, in order.
+COLUMNS = ['depth', 'mean_score', 'wins', 'moves', 'p50_ms', 'p90_ms',
+           'p99_ms', 'max_ms', 'nodes', 'nodes_per_sec', 'peak_rss_mb']
+
+
+def percentile(values, percent):
+    """Return the percent-th percentile of a non-empty list of numbers
+    (the smallest value at least percent% of values are at most)."""
+
+    ordered = sorted(values)
+    rank = -(-len(ordered) * percent // 100)
+    return ordered[max(rank, 1) - 1]
+
+
+def run_depth(depth, decks, stream, prune, reuse):
+    """Autoplay decks 0 to decks - 1 of stream `stream` looking depth
+    moves ahead (or exactly, if depth is None), and return a dict of
+    the results (see COLUMNS)."""
+
+    scores = []
+    move_seconds = []
+    nodes = 0
+
+    for i in range(decks):
+        deck = stream_deck(stream, i)
+        game = RecursiveCribbageSolitaire(
+            deck=deck, verbosity=SILENT, tie_seed=' '.join(deck))
+        scores.append(game.autoplay(depth, prune=prune, reuse=reuse))
+        move_seconds += game.move_seconds
+        nodes += game.game_nodes
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    total_seconds = sum(move_seconds)
+
+    return {
+        'depth': EXACT if depth is None else depth,
+        'mean_score': round(sum(scores) / len(scores), 2),
+        'wins': sum(score >= 61 for score in scores),
+        'moves': len(move_seconds),
+        'p50_ms': round(percentile(move_seconds, 50) * 1000, 3),
+        'p90_ms': round(percentile(move_seconds, 90) * 1000, 3),
+        'p99_ms': round(percentile(move_seconds, 99) * 1000, 3),
+        'max_ms': round(max(move_seconds) * 1000, 3),
+        'nodes': nodes,
+        'nodes_per_sec': round(nodes / total_seconds) if total_seconds else 0,
+        'peak_rss_mb': round(peak_rss, 1),
+    }
+
+
+def scaling(max_depth, exact=False, decks=5, stream=0, prune=False,
+            reuse=False):
+    """Yield the results of run_depth for depths 1 to max_depth, and
+    then exact mode if exact is `True`, each run in a new process."""
+
+    depths = list(range(1, max_depth + 1))
+    if exact:
+        depths.append(None)
+
+    for depth in depths:
+        with concurrent.futures.ProcessPoolExecutor(1) as pool:
+            yield pool.submit(
+                run_depth, depth, decks, stream, prune, reuse).result()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    if not args:
+        print("Error: Expected a max depth, optionally followed by"
+              f" '{EXACT}', '{PRUNE}', '{REUSE}', '{DECKS}<n>',"
+              f" '{STREAM}<s>' and/or '{CSV}<file>', got {args}.")
+        quit(1)
+
+    decks = 5
+    stream = 0
+    csv_file = None
+
+    try:
+        max_depth = int(args[0])
+        for arg in args[1:]:
+            if arg.startswith(DECKS):
+                decks = int(arg[len(DECKS):])
+            elif arg.startswith(STREAM):
+                stream = int(arg[len(STREAM):])
+            elif arg.startswith(CSV):
+                csv_file = arg[len(CSV):]
+            elif arg not in [EXACT, PRUNE, REUSE]:
+                raise ValueError(f"unknown argument {arg}")
+    except ValueError as e:
+        print(f"Entered arguments {args} caused an error: {e}")
+        quit(1)
+
+    if max_depth < 1 or decks < 1:
+        raise TypeError(f"Expected max depth >= 1 and decks >= 1, got"
+                        f" {max_depth} and {decks}.")
+
+    print(''.join(f'{column:>14s}' for column in COLUMNS))
+
+    rows = []
+    for row in scaling(max_depth, EXACT in args, decks, stream,
+                       PRUNE in args, REUSE in args):
+        print(''.join(f'{str(row[column]):>14s}' for column in COLUMNS),
+              flush=True)
+        rows.append(row)
+
+    if csv_file is not None:
+        with open(csv_file, 'w', newline='') as file:
+            writer = csv.DictWriter(file, COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
@@ -0,0 +1,120 @@
+"""Counters of the searches of the Cribbage Solitaire autosolver.
+
+RecursiveCribbageSolitaire keeps a SearchStats in self.search_stats
+when asked to (it is None otherwise, and nothing is counted), and
+starts a new one for every move it chooses, so after determine_move
+it holds the counters of that move's search:
+- nodes: positions visited at each depth (moves from the current
+  position; index 0 is the current position)
+- make_moves, undo_moves: moves made and undone while searching
+- evaluations: points of a card worked out (see
+  final_partA.evaluate_tail): one for each move made, and one for each
+  move scored to order the moves (see
+  RecursiveCribbageSolitaire.order_moves)
+- new_stacks: stacks started while searching
+- cache_hits, cache_misses, cache_stores, cache_evictions: lookups,
+  stores and removals of stored search results (self.subtree_values,
+  or self.solutions in exact mode)
+- pruned: branches skipped by the pruned search
+- ordered_nodes, best_first: positions of the pruned search with more
+  than one move to try, and how many of them had their best move tried
+  first (see RecursiveCribbageSolitaire.order_moves); the better the
+  move ordering, the closer these are and the fewer nodes are visited
+- timeouts: searches stopped by a time budget
+- depth_seconds: seconds taken by the search to each depth (more than
+  one with a time budget)
+- seconds: seconds taken to choose the move
+- planned: `True` if the move was played from a plan (e.g. found in a
+  SolutionStore) without searching, which leaves every counter at 0
+"""
+
+
+class SearchStats:
+    """Counters of one search (see the module docstring)."""
+
+    def __init__(self):
+        """Initialize all counters to 0."""
+
+        self.nodes = []
+        self.make_moves = 0
+        self.evaluations = 0
+        self.undo_moves = 0
+        self.new_stacks = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_stores = 0
+        self.cache_evictions = 0
+        self.pruned = 0
+        self.ordered_nodes = 0
+        self.best_first = 0
+        self.timeouts = 0
+        self.depth_seconds = {}
+        self.seconds = 0.0
+        self.planned = False
+
+        # Length of the game's history when the search started, to
+        # find the depth of positions which don't know it (see
+        # RecursiveCribbageSolitaire.solve_position)
+        self.start_history = 0
+
+    def visit(self, depth):
+        """Count a position visited depth moves from the current one."""
+
+        nodes = self.nodes
+        if depth < len(nodes):
+            nodes[depth] += 1
+        else:
+            nodes += [0] * (depth - len(nodes)) + [1]
+
+    def total_nodes(self):
+        """Return the number of positions visited at all depths."""
+        return sum(self.nodes)
+
+    def add(self, other):
+        """Add the counters of another SearchStats (e.g. from a worker
+        process) to these ones, except the times."""
+
+        for depth, count in enumerate(other.nodes):
+            if depth < len(self.nodes):
+                self.nodes[depth] += count
+            else:
+                self.nodes.append(count)
+
+        self.make_moves += other.make_moves
+        self.evaluations += other.evaluations
+        self.undo_moves += other.undo_moves
+        self.new_stacks += other.new_stacks
+        self.cache_hits += other.cache_hits
+        self.cache_misses += other.cache_misses
+        self.cache_stores += other.cache_stores
+        self.cache_evictions += other.cache_evictions
+        self.pruned += other.pruned
+        self.ordered_nodes += other.ordered_nodes
+        self.best_first += other.best_first
+        self.timeouts += other.timeouts
+
+    def as_dict(self):
+        """Return the counters as a dict which can be saved as JSON."""
+
+        return {
+            'nodes': self.total_nodes(),
+            'nodes_by_depth': self.nodes,
+            'make_moves': self.make_moves,
+            'undo_moves': self.undo_moves,
+            'evaluations': self.evaluations,
+            'new_stacks': self.new_stacks,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cache_stores': self.cache_stores,
+            'cache_evictions': self.cache_evictions,
+            'pruned': self.pruned,
+            'ordered_nodes': self.ordered_nodes,
+            'best_first': self.best_first,
+            'best_first_rate': round(self.best_first / self.ordered_nodes, 4)
+            if self.ordered_nodes else None,
+            'timeouts': self.timeouts,
+            'depth_seconds': {str(depth): round(seconds, 6) for depth, seconds
+                              in self.depth_seconds.items()},
+            'seconds': round(self.seconds, 6),
+            'planned': self.planned,
+        }
@@ -0,0 +1,117 @@
+"""On-disk store of solved Cribbage Solitaire decks.
+
+Solving a deck deeply takes minutes, and the same decks are played
+again and again, so the solvers can save what they found in a
+SolutionStore (an SQLite database file) and look it up the next time
+instead of searching again.
+
+A solution is stored under
+- the fingerprint of the deck: the SHA-256 of its ranks in order
+- the solver settings (see solver_settings), as the moves found
+  depend on how far ahead the solver looks
+and holds the final score, the moves played (column indices) and
+stats of the search that found them (e.g. the positions searched and
+the seconds taken).
+
+Only solutions which are the same every time are stored: ties between
+equally good moves must be broken with the deck's tie seed (see
+CribbageSolitaire.choose), and a search with a time budget isn't
+stored at all, since how far it looks depends on the machine.
+"""
+
+import hashlib
+import json
+import sqlite3
+
+
+class SolutionStore:
+    """Solutions of decks in an SQLite database file (see the module
+    docstring)."""
+
+    def __init__(self, filename):
+        """Open the store in the file filename, making it if needed.
+
+        Several processes can use the same store at once.
+        """
+
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS solutions ('
+            ' deck TEXT, settings TEXT, score INTEGER, moves TEXT,'
+            ' stats TEXT, PRIMARY KEY (deck, settings)) WITHOUT ROWID')
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the store."""
+        self.connection.close()
+
+    def get(self, deck, settings):
+        """Return the solution of deck (a list of ranks) found with the
+        solver settings `settings`, or None if there isn't one.
+
+        Return value: a dict of the 'score', the 'moves' (a list of
+        column indices) and the 'stats' (a dict) of the solution
+        """
+
+        row = self.connection.execute(
+            'SELECT score, moves, stats FROM solutions'
+            ' WHERE deck = ? AND settings = ?',
+            (deck_fingerprint(deck), settings)).fetchone()
+
+        if row is None:
+            return None
+
+        return {'score': row[0], 'moves': json.loads(row[1]),
+                'stats': json.loads(row[2])}
+
+    def put(self, deck, settings, score, moves, stats):
+        """Save the solution of deck found with the solver settings
+        `settings`, replacing any saved before.
+
+        Arguments:
+        - deck: the deck (a list of ranks)
+        - settings: the solver settings (see solver_settings)
+        - score: the final point total
+        - moves: the moves played (a list of column indices)
+        - stats: a dict of stats of the search, which can be saved as
+          JSON
+        """
+
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?, ?)',
+                (deck_fingerprint(deck), settings, score, json.dumps(moves),
+                 json.dumps(stats)))
+
+    def __len__(self):
+        """Return the number of solutions stored."""
+
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM solutions').fetchone()[0]
+
+
+def deck_fingerprint(deck):
+    """Return the fingerprint of a deck (a list of ranks): the hex
+    SHA-256 of its ranks in order."""
+
+    return hashlib.sha256(' '.join(deck).encode()).hexdigest()
+
+
+def solver_settings(depth, time_budget=None, prune=False, reuse=False):
+    """Return the key of the settings of the autosolver of final_partC1
+    (the arguments of RecursiveCribbageSolitaire.autoplay), or None if
+    its solutions can't be stored (with a time budget)."""
+
+    if time_budget is not None:
+        return None
+
+    depth = 'exact' if depth is None else depth
+    return f'depth={depth} prune={int(prune)} reuse={int(reuse)}'
@@ -0,0 +1,322 @@
+"""Tournament between Cribbage Solitaire players on the same decks.
+
+Every player (policy) plays every deck, so the difference between two
+players' scores on a deck is a paired sample, with the luck of the deck
+taken out.  Players are:
+- random: a random legal move
+- greedy: the one move look ahead of CribbageSolitaire.best_moves
+- the autosolver of final_partC1, given a depth as for final_partC1.py:
+  a number of moves to look ahead, "exact", or a time budget per move
+  such as "500ms"
+
+Decks are played a batch at a time, several games at once in worker
+processes, until the 95% confidence interval of every paired
+difference is within +-precision points (after at least one batch), or
+the decks run out.  Then it prints, for each player, the mean score,
+the win rate (61 points or more) and the CPU time of its games, and the
+mean difference from the player before it, each with its 95% interval.
+
+Ties between equally good moves (and the random player's moves) are
+broken with a seed made from the deck, so every deck is always played
+the same way.
+
+Calling:
+python3 cribbage_tournament.py <player>... [<deck file or directory>...]
+                               [stream=<s>] [decks=<n>] [batch=<n>]
+                               [precision=<points>] [prune] [reuse]
+                               [workers=<n>]
+<player>: random, greedy, or a depth (see above). List them in the
+order to compare them in, e.g. "random greedy 1 2 3 4".
+<deck file or directory>: deck files or corpus files (see
+cribbage_batch), played in order. Without any, seeded decks are played
+(see final_partA.stream_deck).
+stream=<s>: the seeded deck stream to play (default 0)
+decks=<n>: play at most n decks (default 1000)
+batch=<n>: decks played between checks of the intervals (default 20)
+precision=<points>: stop once every interval of a paired difference is
+at most this wide on each side (default 1)
+prune, reuse: as for final_partC1.py
+workers=<n>: play n games at a time, in n processes (default 1)
+"""
+
+import functools
+import itertools
+import math
+
+from cribbage_batch import *
+
+
+# Players which aren't the autosolver of final_partC1.
+RANDOM = 'random'
+GREEDY = 'greedy'
+
+# Optional arguments giving the deck stream, the most decks to play,
+# the decks played between checks and the precision to stop at.
+STREAM = 'stream='
+DECKS = 'decks='
+BATCH = 'batch='
+PRECISION = 'precision='
+
+# Defaults of those arguments.
+DEFAULT_DECKS = 1000
+DEFAULT_BATCH = 20
+DEFAULT_PRECISION = 1
+
+# Normal quantile of a two-sided 95% confidence interval.
+Z_95 = 1.96
+
+
+def is_player(arg):
+    """Return `True` if the argument arg names a player."""
+
+    if arg in [RANDOM, GREEDY]:
+        return True
+
+    try:
+        parse_depth(arg)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+
+def random_playout(game):
+    """Play the game to the end with random legal moves (chosen with
+    game.choose), and return the final point total."""
+
+    while not game.game_over():
+        moves = game.legal_moves()
+        if not moves:
+            game.new_stack()
+            continue
+        game.make_move(game.choose(moves))
+
+    return game.points
+
+
+def play(player, deck, prune=False, reuse=False):
+    """Play a deck with a player, without printing anything.
+
+    Arguments:
+    - player: RANDOM, GREEDY or a depth argument (see parse_depth)
+    - deck: the deck (a list of ranks)
+    - prune, reuse: as for RecursiveCribbageSolitaire.autoplay
+
+    Return value: a 2-tuple of the final point total and the CPU
+    seconds the game took
+    """
+
+    start = time.process_time()
+    tie_seed = ' '.join(deck)
+
+    if player == RANDOM:
+        game = CribbageSolitaire(deck=deck, verbosity=SILENT,
+                                 tie_seed=tie_seed)
+        points = random_playout(game)
+    elif player == GREEDY:
+        game = CribbageSolitaire(deck=deck, verbosity=SILENT,
+                                 tie_seed=tie_seed)
+        points = game.autoplay()
+    else:
+        depth, time_budget = parse_depth(player)
+        game = RecursiveCribbageSolitaire(deck=deck, verbosity=SILENT,
+                                          tie_seed=tie_seed)
+        points = game.autoplay(depth, prune=prune, time_budget=time_budget,
+                               reuse=reuse)
+
+    return points, time.process_time() - start
+
+
+def play_game(game, prune=False, reuse=False):
+    """Play a (player, deck) 2-tuple (see `play`)."""
+    return play(game[0], game[1], prune, reuse)
+
+
+def mean_interval(values):
+    """Return a 2-tuple of the mean of a list of numbers and the half
+    width of its 95% confidence interval (infinite for fewer than 2
+    values)."""
+
+    n = len(values)
+    mean = sum(values) / n
+
+    if n < 2:
+        return mean, math.inf
+
+    variance = sum((value - mean) ** 2 for value in values) / (n - 1)
+    return mean, Z_95 * math.sqrt(variance / n)
+
+
+def wilson_interval(wins, n):
+    """Return the 95% confidence interval (low, high) of a win rate of
+    wins out of n games (the Wilson score interval, which stays inside
+    [0, 1] even for rates near 0 or 1)."""
+
+    rate = wins / n
+    z2 = Z_95 ** 2
+    centre = (rate + z2 / (2 * n)) / (1 + z2 / n)
+    half_width = Z_95 * math.sqrt(rate * (1 - rate) / n + z2 / (4 * n * n)) \
+        / (1 + z2 / n)
+
+    return max(0.0, centre - half_width), min(1.0, centre + half_width)
+
+
+def paired_differences(scores, player, other):
+    """Return the score of player minus the score of other on every
+    deck both have played."""
+
+    return [a - b for a, b in zip(scores[player], scores[other])]
+
+
+def precise_enough(players, scores, precision):
+    """Return `True` if the 95% interval of the paired difference of
+    every player from the one before it (or of the score, with only one
+    player) is at most precision points wide on each side."""
+
+    if len(players) == 1:
+        return mean_interval(scores[players[0]])[1] <= precision
+
+    return all(mean_interval(paired_differences(
+        scores, players[i], players[i - 1]))[1] <= precision
+        for i in range(1, len(players)))
+
+
+def tournament(players, decks, batch=DEFAULT_BATCH,
+               precision=DEFAULT_PRECISION, prune=False, reuse=False,
+               workers=1):
+    """Play decks with every player, `batch` decks at a time, until the
+    intervals are within precision (see precise_enough) or the decks
+    run out.
+
+    Arguments:
+    - players: the players (see `play`), in the order to compare them
+    - decks: the decks to play, in order (a list or an iterator)
+    - batch: the number of decks to play between checks
+    - precision: see precise_enough
+    - prune, reuse: as for RecursiveCribbageSolitaire.autoplay
+    - workers: the number of games to play at a time, in processes
+
+    Return value: a 2-tuple of dicts from each player to
+    - its scores, in the order of the decks
+    - the CPU seconds of all its games
+    """
+
+    scores = {player: [] for player in players}
+    cpu_seconds = {player: 0.0 for player in players}
+    decks = iter(decks)
+
+    play_one = functools.partial(play_game, prune=prune, reuse=reuse)
+    pool = None
+    if workers > 1:
+        pool = concurrent.futures.ProcessPoolExecutor(workers)
+
+    try:
+        while True:
+            games = [(player, deck) for deck in itertools.islice(decks, batch)
+                     for player in players]
+            if not games:
+                break
+
+            if pool is None:
+                results = map(play_one, games)
+            else:
+                results = pool.map(play_one, games, chunksize=max(
+                    1, len(games) // (workers * 4)))
+
+            for (player, deck), (points, seconds) in zip(games, results):
+                scores[player].append(points)
+                cpu_seconds[player] += seconds
+
+            if precise_enough(players, scores, precision):
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return scores, cpu_seconds
+
+
+def report(players, scores, cpu_seconds):
+    """Print the results of a tournament (see the module docstring)."""
+
+    print(f"{'player':<10s}{'decks':>7s}{'mean score':>16s}"
+          f"{'win rate':>22s}{'vs previous':>16s}{'CPU s':>10s}")
+
+    for i, player in enumerate(players):
+        n = len(scores[player])
+        mean, half_width = mean_interval(scores[player])
+        wins = sum(points >= WIN_POINTS for points in scores[player])
+        low, high = wilson_interval(wins, n)
+
+        line = (f"{player:<10s}{n:>7d}{mean:>9.2f} +-{half_width:>5.2f}"
+                f"{wins / n:>9.1%} [{low:>5.1%}, {high:>5.1%}]")
+
+        if i > 0:
+            difference, half_width = mean_interval(
+                paired_differences(scores, player, players[i - 1]))
+            line += f"{difference:>+9.2f} +-{half_width:>5.2f}"
+        else:
+            line += f"{'':>16s}"
+
+        print(line + f"{cpu_seconds[player]:>10.2f}")
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    players = []
+    while len(players) < len(args) and is_player(args[len(players)]):
+        players.append(args[len(players)])
+    rest = args[len(players):]
+
+    options = [arg for arg in rest if arg in [PRUNE, REUSE]
+               or arg.startswith((STREAM, DECKS, BATCH, PRECISION, WORKERS))]
+    paths = [arg for arg in rest if arg not in options]
+
+    if not players:
+        print(f"Error: Expected at least one player ('{RANDOM}', '{GREEDY}'"
+              " or a depth), optionally followed by deck files or"
+              f" directories, '{STREAM}<s>', '{DECKS}<n>', '{BATCH}<n>',"
+              f" '{PRECISION}<points>', '{PRUNE}', '{REUSE}' and/or"
+              f" '{WORKERS}<n>', got {args}.")
+        quit(1)
+
+    stream = 0
+    max_decks = DEFAULT_DECKS
+    batch = DEFAULT_BATCH
+    precision = DEFAULT_PRECISION
+    workers = 1
+
+    try:
+        for option in options:
+            if option.startswith(STREAM):
+                stream = int(option[len(STREAM):])
+            elif option.startswith(DECKS):
+                max_decks = int(option[len(DECKS):])
+            elif option.startswith(BATCH):
+                batch = int(option[len(BATCH):])
+            elif option.startswith(PRECISION):
+                precision = float(option[len(PRECISION):])
+            elif option.startswith(WORKERS):
+                workers = int(option[len(WORKERS):])
+    except ValueError as e:
+        print(f"Entered arguments {rest} caused an error: {e}")
+        quit(1)
+
+    if max_decks < 1 or batch < 1 or workers < 1:
+        raise TypeError(f"Expected decks, batch and workers >= 1, got"
+                        f" {max_decks}, {batch} and {workers}.")
+
+    if paths:
+        try:
+            sources = deck_sources(paths)[:max_decks]
+            decks = [load_source(source) for source in sources]
+        except (OSError, ValueError, InvalidCorpus, InvalidDeck) as e:
+            print(f"Reading the decks caused an error: {e}")
+            quit(1)
+    else:
+        decks = (stream_deck(stream, i) for i in range(max_decks))
+
+    scores, cpu_seconds = tournament(players, decks, batch, precision,
+                                     PRUNE in options, REUSE in options,
+                                     workers)
+    report(players, scores, cpu_seconds)
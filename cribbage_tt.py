@@ -0,0 +1,318 @@
+"""Transposition tables of a fixed size for the Cribbage Solitaire
+autosolver.
+
+The autosolver of final_partC1 stores search results in dicts, which
+grow with every position searched: an exact solve of a whole deck
+stores millions of them, at a few hundred bytes each.  A
+TranspositionTable holds the same results (position key -> (points,
+move)) in a fixed amount of memory instead, in two arrays:
+- values: one 4 byte slot per entry, holding the points (bits 0-11),
+  the move plus 1 (bits 12-18, 0 for None), the entry's weight (bits
+  19-24) and the generation it was stored in (bits 25-31)
+- keys: one 8 byte slot per entry, holding the key plus 1, XORed with
+  the value slot, so a slot whose two halves don't belong together
+  (or an empty one, all 0) never matches a key
+
+The slots are split into buckets of WAYS slots, and a key can only be
+in the bucket its hash picks.  When that bucket is full, storing a new
+key replaces an entry from an older generation (see new_generation)
+if there is one, and otherwise the entry with the least weight: the
+weight of an entry says how much searching it saves (e.g. how many
+moves ahead it looked), so the results that were most expensive to
+find are kept longest.  Losing an entry never changes what the solver
+finds, only how long it takes.
+
+The arrays are only made when the first entry is stored, so an unused
+table (or one sent to another process before it is used) takes no
+memory.
+
+A SharedTranspositionTable keeps its arrays in shared memory instead,
+so the worker processes of a parallel search all read and write the
+same one.  There are no locks: the XOR of the two halves of a slot
+means a slot half written by one process while another reads it is
+just a miss.
+"""
+
+import atexit
+from array import array
+from multiprocessing import shared_memory
+
+
+# Slots per bucket.
+WAYS = 4
+
+# Bytes of one entry (a key slot and a value slot).
+KEY_BYTES = array('Q').itemsize
+VALUE_BYTES = array('I').itemsize
+ENTRY_BYTES = KEY_BYTES + VALUE_BYTES
+
+# Fields of a value slot.
+POINTS_MASK = (1 << 12) - 1
+MOVE_SHIFT = 12
+WEIGHT_SHIFT = 19
+GENERATION_SHIFT = 25
+MAX_WEIGHT = 63
+GENERATIONS = 128
+
+# Odd 64-bit constant which spreads the keys over the buckets
+# (Fibonacci hashing).
+HASH_MULTIPLIER = 0x9e3779b97f4a7c15
+MASK_64 = (1 << 64) - 1
+
+
+class TranspositionTable:
+    """Search results in a fixed amount of memory (see the module
+    docstring).
+
+    Used like the dict it replaces: `table.get(key)`, `key in table`,
+    `table[key]` and `table[key] = (points, move)`, where key is an
+    int of at most 63 bits, points an int from 0 to 4095 and move an
+    int from 0 to 126 or None.
+    """
+
+    def __init__(self, megabytes, weight):
+        """Make an empty table.
+
+        Arguments:
+        - megabytes: the most memory the arrays may take (MiB)
+        - weight: a function returning the weight of a key (an int;
+          entries with less weight are replaced first, and weights
+          above MAX_WEIGHT count as MAX_WEIGHT). It has to be a
+          module level function so the table can be sent to worker
+          processes.
+        """
+
+        self.megabytes = megabytes
+        self.weight = weight
+
+        # Number of buckets: the largest power of 2 which fits
+        buckets = 1
+        while buckets * 2 * WAYS * ENTRY_BYTES <= megabytes * 2 ** 20:
+            buckets *= 2
+        self.bucket_bits = buckets.bit_length() - 1
+        self.slots = buckets * WAYS
+
+        self.keys = None
+        self.values = None
+        self.size = 0
+        self.generation = 0
+
+        # Lookups which found their key or didn't, entries stored, and
+        # entries replaced by another key
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def allocate(self):
+        """Make the arrays of the table."""
+
+        self.keys = array('Q', [0]) * self.slots
+        self.values = array('I', [0]) * self.slots
+
+    def bucket(self, key):
+        """Return the first slot of the bucket of key."""
+
+        return ((key * HASH_MULTIPLIER & MASK_64) >> 64 - self.bucket_bits) \
+            * WAYS
+
+    def get(self, key, default=None):
+        """Return the (points, move) stored under key, or default."""
+
+        if self.keys is not None:
+            keys = self.keys
+            values = self.values
+            tag = key + 1
+            start = self.bucket(key)
+
+            for slot in range(start, start + WAYS):
+                value = values[slot]
+                if keys[slot] ^ value == tag:
+                    self.hits += 1
+                    move = (value >> MOVE_SHIFT & 0x7f) - 1
+                    return value & POINTS_MASK, None if move < 0 else move
+
+        self.misses += 1
+        return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        """Store value, a 2-tuple (points, move), under key, replacing
+        an old or the lightest entry of its bucket if it is full."""
+
+        if self.keys is None:
+            self.allocate()
+
+        keys = self.keys
+        values = self.values
+        tag = key + 1
+        start = self.bucket(key)
+        generation = self.generation
+
+        victim = start
+        lowest = 2 * (MAX_WEIGHT + 1)
+
+        for slot in range(start, start + WAYS):
+            old_value = values[slot]
+            old_tag = keys[slot] ^ old_value
+            if old_tag == tag:
+                victim = slot
+                break
+            if old_tag == 0:
+                victim = slot
+                self.size += 1
+                break
+
+            # Entries of this generation are only replaced once there
+            # are none from earlier ones
+            score = old_value >> WEIGHT_SHIFT & MAX_WEIGHT
+            if old_value >> GENERATION_SHIFT == generation:
+                score += MAX_WEIGHT + 1
+            if score < lowest:
+                victim = slot
+                lowest = score
+        else:
+            self.evictions += 1
+
+        points, move = value
+        move = 0 if move is None else move + 1
+        new_value = points | move << MOVE_SHIFT \
+            | min(self.weight(key), MAX_WEIGHT) << WEIGHT_SHIFT \
+            | generation << GENERATION_SHIFT
+
+        # A process reading the slot between these writes sees halves
+        # which don't match: a miss
+        values[victim] = new_value
+        keys[victim] = tag ^ new_value
+        self.stores += 1
+
+    def __len__(self):
+        """Return the number of entries stored."""
+        return self.size
+
+    def new_generation(self):
+        """Start a new generation: the entries stored so far are still
+        found, but are replaced before any stored from now on (e.g.
+        when the search moves on to positions they can't lead to)."""
+
+        self.generation = (self.generation + 1) % GENERATIONS
+
+    def counters(self):
+        """Return the counters of the table as a 4-tuple: hits, misses,
+        stores and evictions."""
+
+        return self.hits, self.misses, self.stores, self.evictions
+
+    def add_counters(self, counters):
+        """Add counters (see `counters`, e.g. of the same shared table
+        in a worker process) to those of the table."""
+
+        self.hits += counters[0]
+        self.misses += counters[1]
+        self.stores += counters[2]
+        self.evictions += counters[3]
+
+    def hit_rate(self):
+        """Return the fraction of lookups which found their key."""
+
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+# Shared tables this process has attached to (shared memory name ->
+# SharedTranspositionTable), so each worker attaches only once.
+attached_tables = {}
+
+
+class SharedTranspositionTable(TranspositionTable):
+    """A TranspositionTable in shared memory, which worker processes it
+    is sent to (pickled) all use (see the module docstring).
+
+    The process which made it must `close` it when done, which frees
+    the shared memory.
+    """
+
+    def __init__(self, megabytes, weight, name=None):
+        """Make an empty table, or if name is not None, attach to the
+        shared table with that shared memory name (see
+        TranspositionTable.__init__ for the other arguments)."""
+
+        TranspositionTable.__init__(self, megabytes, weight)
+
+        self.owner = name is None
+        if self.owner:
+            # New shared memory is filled with 0s: every slot is empty
+            self.memory = shared_memory.SharedMemory(
+                create=True, size=self.slots * ENTRY_BYTES)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.allocate()
+
+    def allocate(self):
+        """Use the shared memory as the arrays of the table."""
+
+        split = self.slots * KEY_BYTES
+        self.keys = self.memory.buf[:split].cast('Q')
+        self.values = self.memory.buf[
+            split:split + self.slots * VALUE_BYTES].cast('I')
+
+    def __reduce__(self):
+        """Pickle the table as the name of its shared memory."""
+
+        return attach_table, (self.megabytes, self.weight, self.memory.name,
+                              self.generation)
+
+    def __len__(self):
+        """Return the number of entries stored, by all processes."""
+
+        keys = self.keys
+        values = self.values
+        return sum(1 for slot in range(self.slots)
+                   if keys[slot] ^ values[slot])
+
+    def close(self):
+        """Stop using the table, and free the shared memory if this
+        process made it."""
+
+        if self.keys is None:
+            return
+
+        self.keys.release()
+        self.values.release()
+        self.keys = self.values = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+        elif attached_tables.get(self.memory.name) is self:
+            del attached_tables[self.memory.name]
+
+
+def attach_table(megabytes, weight, name, generation):
+    """Return the shared table with shared memory name `name` (see
+    SharedTranspositionTable.__reduce__), attaching to it the first
+    time."""
+
+    table = attached_tables.get(name)
+    if table is None:
+        table = attached_tables[name] = SharedTranspositionTable(
+            megabytes, weight, name)
+    table.generation = generation
+
+    return table
+
+
+@atexit.register
+def close_attached_tables():
+    """Close the shared tables this process attached to, which must
+    happen before their shared memory is closed at exit."""
+
+    for table in list(attached_tables.values()):
+        table.close()
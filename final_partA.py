@@ -55,6 +55,19 @@ rank_count = {
 }
 
 
+# Longest straight each rank can be part of without the count going
+# over 31 (e.g. 8 fits in 4-5-6-7-8, but 9 only fits in 6-7-8-9).
+straight_limit = {
+    'A': 7, '2': 7, '3': 7, '4': 7,
+    '5': 7, '6': 7, '7': 7, '8': 5,
+    '9': 4, '10': 3, 'J': 3, 'Q': 3, 'K': 3
+}
+
+
+# Packed tail (see pack_tail) of an empty stack.
+EMPTY_TAIL = 0
+
+
 class InvalidDeck(Exception):
     """Exception class for invalid card decks (ranks only)."""
 
@@ -143,15 +156,350 @@ def evaluate(stack):
     return (points, point_tags)
 
 
-def make_deck():
-    """Return a shuffled "deck" of 52 cards (ranks only)."""
+def evaluate_last(stack, count):
+    """Return the same result as `evaluate(stack)`, in constant time.
+
+    evaluate re-adds the whole stack and checks every slice of it.
+    Here the count is passed in (the game keeps it up to date), and
+    only the top of the stack is looked at: the ranks in a row equal
+    to the last card for pairs, or else the distinct ranks at the top
+    (kept in a bitmask of rank orders) for straights.  A pair and a
+    straight can't both end in the same card.
+
+    Arguments:
+    - stack: a non-empty list of card ranks
+    - count: the count of the whole stack
+
+    Return value: a 2-tuple of
+    - the points gained from the last card in the stack
+    - a list of tags of the cribbage point types from the last card
+      in the stack.
+    """
+
+    last = stack[-1]
+    stack_length = len(stack)
+
+    if stack_length == 1 and last == 'J':
+        # If they played the only Jack, they can only get 2 points.
+        return (2, ['j'])
+
+    points = 0
+    point_tags = []
+
+    if count == 15 or count == 31:
+        points += 2
+        point_tags.append("c" + str(count))
+
+    # Add points for pair, triplet or quadruplet
+    same = 1
+    while same < stack_length and stack[-same - 1] == last:
+        same += 1
+
+    if same > 1:
+        points += same * (same - 1)
+        point_tags.append("k" + str(same))
+        return (points, point_tags)
+
+    # Add points for the longest straight of 3 or more cards, looking
+    # down the stack until a rank repeats
+    order = rank_order[last]
+    seen = 1 << order
+    lowest = highest = order
+    longest = 0
+
+    for length in range(2, stack_length + 1):
+        order = rank_order[stack[-length]]
+        if seen >> order & 1:
+            break
+        seen |= 1 << order
+
+        if order < lowest:
+            lowest = order
+        elif order > highest:
+            highest = order
+
+        if length >= 3 and highest - lowest + 1 == length:
+            longest = length
+
+    if longest:
+        points += longest
+        point_tags.append("s" + str(longest))
+
+    return (points, point_tags)
+
+
+def pack_tail(stack):
+    """Return the packed tail of a stack, as used by `evaluate_tail`.
+
+    The tail is everything the next card's pair or straight can
+    depend on: the number of cards of the top rank in a row, and the
+    distinct ranks at the top of the stack for as long as they span
+    at most 7 ranks (a straight can't be longer than 7 cards without
+    the count going over 31), at most 6 of them.  It is packed into an
+    int: rank orders top card first, 4 bits each, and the run length
+    above them (bits 24-26).  An empty stack has tail EMPTY_TAIL.
+    """
+
+    if not stack:
+        return EMPTY_TAIL
+
+    top = stack[-1]
+    run = 1
+    while run < min(4, len(stack)) and stack[-run - 1] == top:
+        run += 1
+
+    if run > 1:
+        return run << 24 | rank_order[top]
+
+    tail = 0
+    seen = 0
+    lowest = highest = rank_order[top]
+
+    for i in range(1, min(6, len(stack)) + 1):
+        order = rank_order[stack[-i]]
+        lowest = min(lowest, order)
+        highest = max(highest, order)
+        if seen >> order & 1 or highest - lowest > 6:
+            break
+        seen |= 1 << order
+        tail |= order << 4 * (i - 1)
+
+    return 1 << 24 | tail
+
+
+def unpack_tail(tail):
+    """Return a list of ranks with packed tail `tail` (see pack_tail)."""
+
+    run = tail >> 24
+    orders = tail & 0xffffff
+    ranks = []
+
+    while orders:
+        ranks.insert(0, valid_ranks[(orders & 0xf) - 1])
+        orders >>= 4
+
+    if run > 1:
+        ranks = ranks * run
+
+    return ranks
+
+
+def tail_entry(tail, rank):
+    """Return the tail_table entry for playing rank onto a stack with
+    packed tail `tail`: a 3-tuple of the points and tags from pairs,
+    straights or an initial jack (not the count), and the new tail."""
+
+    order = rank_order[rank]
+    run = tail >> 24
+    orders = tail & 0xffffff
+
+    if tail == EMPTY_TAIL:
+        if rank == 'J':
+            # If they played the only Jack, they can only get 2 points.
+            return 2, ('j',), 1 << 24 | order
+        return 0, (), 1 << 24 | order
+
+    if orders & 0xf == order:
+        # One more card of the top rank in a row
+        run = min(run + 1, 4)
+        return run * (run - 1), ("k" + str(run),), run << 24 | order
+
+    # Walk down the distinct ranks of the old tail, finding the longest
+    # straight and the ranks which stay in the new tail
+    new_orders = order
+    kept = 1
+    seen = 1 << order
+    lowest = highest = order
+    longest = 0
+
+    while orders:
+        below = orders & 0xf
+        orders >>= 4
+        if seen >> below & 1:
+            break
+        seen |= 1 << below
+        if below < lowest:
+            lowest = below
+        elif below > highest:
+            highest = below
+        if highest - lowest > 6:
+            break
+
+        if kept < 6:
+            new_orders |= below << 4 * kept
+        kept += 1
+
+        if kept >= 3 and highest - lowest + 1 == kept:
+            longest = kept
+
+    if longest:
+        return longest, ("s" + str(longest),), 1 << 24 | new_orders
+
+    return 0, (), 1 << 24 | new_orders
+
+
+def build_tail_table():
+    """Return a lookup table from (packed tail << 4 | rank order) to
+    tail_entry(tail, rank), for every tail and card that can happen in
+    a game (the ranks in a stack can't add up to more than 31)."""
+
+    table = {}
+    tails = [EMPTY_TAIL]
+    tail_counts = {EMPTY_TAIL: 0}
+
+    while tails:
+        tail = tails.pop()
+        tail_count = tail_counts[tail]
+
+        for rank in valid_ranks:
+            if tail_count + rank_count[rank] > 31:
+                continue
+
+            entry = tail_entry(tail, rank)
+            table[tail << 4 | rank_order[rank]] = entry
+
+            new_tail = entry[2]
+            if new_tail not in tail_counts:
+                tail_counts[new_tail] = sum(
+                    rank_count[card] for card in unpack_tail(new_tail))
+                tails.append(new_tail)
+
+    return table
+
+
+def evaluate_tail(tail, rank, count):
+    """Return the points gained from playing a card, with one table
+    lookup.
+
+    This gives the same points and tags as `evaluate` on the stack
+    after the card is played, as long as the count is at most 31.
+
+    Arguments:
+    - tail: the packed tail of the stack before the card is played
+      (see pack_tail)
+    - rank: the rank of the card played
+    - count: the count of the stack after the card is played
+
+    Return value: a 3-tuple of
+    - the points gained from the card
+    - a list of tags of the cribbage point types from the card
+    - the packed tail of the stack after the card is played
+    """
+
+    key = tail << 4 | rank_order[rank]
+    entry = tail_table.get(key)
+    if entry is None:
+        entry = tail_table[key] = tail_entry(tail, rank)
+
+    points, point_tags, new_tail = entry
+
+    if count == 15 or count == 31:
+        return points + 2, ["c" + str(count)] + list(point_tags), new_tail
+
+    return points, list(point_tags), new_tail
+
+
+def live_tail(stack, count):
+    """Return the part of the stack that can still affect future points.
+
+    A card deep in the stack only matters later if it can still be part
+    of a pair or a straight ending in a card not played yet.  Pairs only
+    look at the run of equal ranks at the top of the stack, and a
+    straight can only reach back through distinct ranks spanning at most
+    7 ranks whose gaps can still be filled without the count going
+    over 31.
+
+    Arguments:
+    - stack: a list of card ranks
+    - count: the count of the stack
+
+    Return value: the shortest suffix of `stack` (a tuple) holding
+    everything that can affect points scored from now on.
+    """
+
+    if not stack:
+        return ()
+
+    # Length of the suffix needed for pairs: the run of equal ranks at
+    # the top of the stack, if another card of that rank still fits.
+    pair_length = 0
+    if count + rank_count[stack[-1]] <= 31:
+        pair_length = 1
+        while pair_length < min(3, len(stack)) \
+                and stack[-pair_length - 1] == stack[-1]:
+            pair_length += 1
+
+    # Length of the suffix needed for straights: the longest suffix
+    # which some cards still to be played could turn into a straight.
+    straight_length = 0
+    seen = []
+    low = high = None
+
+    for rank in reversed(stack[-6:]):
+        order = rank_order[rank]
+        if order in seen:
+            break
+        seen.append(order)
+        low = order if low is None else min(low, order)
+        high = order if high is None else max(high, order)
+
+        if high - low >= 7:
+            break
+
+        # Cheapest way to finish a straight: play every missing rank
+        # inside the span, or one rank on either end if there are none.
+        cost = 0
+        for missing in range(low, high + 1):
+            if missing not in seen:
+                cost += rank_count[valid_ranks[missing - 1]]
+        size = high - low + 1
+        if cost == 0:
+            ends = [rank_count[valid_ranks[end - 1]]
+                    for end in (low - 1, high + 1) if 1 <= end <= 13]
+            cost = min(ends)
+            size += 1
+
+        if size <= 7 and count + cost <= 31:
+            straight_length = len(seen)
+
+    length = max(pair_length, straight_length)
+    if length == 0:
+        return ()
+
+    return tuple(stack[-length:])
+
+
+def make_deck(seed=None):
+    """Return a shuffled "deck" of 52 cards (ranks only).
+
+    If seed is not None, the deck is shuffled by its own
+    random.Random(seed), so a seed always gives the same deck.
+    """
 
     deck = valid_ranks * 4
-    random.shuffle(deck)
+    if seed is None:
+        random.shuffle(deck)
+    else:
+        random.Random(seed).shuffle(deck)
 
     return deck
 
 
+def stream_deck(stream, index):
+    """Return deck number index of the seeded deck stream `stream`.
+
+    Every deck of every stream is shuffled with its own seed, made from
+    both numbers, so deck i can be made without making decks 0 to
+    i - 1, and always comes out the same.
+
+    Arguments:
+    - stream: the number of the deck stream
+    - index: the number of the deck in the stream
+    """
+
+    return make_deck(f'deck {stream} {index}')
+
+
 def validate_deck(cards):
     """
     Validate a deck of cards (ranks only).
@@ -215,3 +563,8 @@ def load_deck(filename):
 
     file.close()
     return deck
+
+
+# Scores of every card played onto every stack tail (see
+# build_tail_table).  Tails missing from it are added as they are seen.
+tail_table = build_tail_table()
@@ -25,6 +25,7 @@ import sys
 
 
 from final_partA import *
+from cribbage_position import *
 
 
 class InvalidMove(Exception):
@@ -33,19 +34,46 @@ class InvalidMove(Exception):
     pass
 
 
+# Verbosity levels of autoplay: print nothing, print the moves and the
+# result, or also print the board before every move (and save the
+# moves to 'moves.out').
+SILENT = 0
+MOVES = 1
+BOARD = 2
+
+
 class CribbageSolitaire:
     """Cribbage Solitaire interactive player and autosolver."""
 
-    def __init__(self):
-        """Initialize this object."""
-        deck = make_deck()
-        save_deck(deck, 'deck.out')
+    def __init__(self, deck=None, seed=None, verbosity=BOARD,
+                 tie_seed=None):
+        """Initialize this object.
 
-        self.cols = [deck[:13], deck[13:26], deck[26:39], deck[39:]]
-        self.stack = []
-        self.count = 0
-        self.points = 0
-        self.history = []
+        Arguments:
+        - deck: the deck to play (a list of 52 ranks), or None to
+          shuffle a new one
+        - seed: if not None, the seed to shuffle the new deck with
+          (see make_deck)
+        - verbosity: how much autoplay prints (SILENT, MOVES or BOARD)
+        - tie_seed: if not None, the seed of the choices between
+          equally good moves, which are then the same every time the
+          game is played (see choose)
+
+        A new deck shuffled without a seed is saved to 'deck.out', so
+        the game can be replayed. Given a deck or a seed, nothing is
+        written to disk.
+        """
+
+        if deck is None:
+            deck = make_deck(seed)
+            if seed is None:
+                save_deck(deck, 'deck.out')
+        else:
+            validate_deck(deck)
+
+        self.verbosity = verbosity
+        self.rng = None if tie_seed is None else random.Random(tie_seed)
+        self.set_deck(deck)
 
     def __str__(self):
         """Convert the layout to a string for printing."""
@@ -81,13 +109,49 @@ class CribbageSolitaire:
         validate_deck(deck)
 
         # NOTE: Does not shuffle deck from filename before storing
+        self.set_deck(deck)
+
+    def set_deck(self, deck):
+        """Use the (valid) deck `deck` to initialize the columns, and
+        reset the other fields of the object."""
+
         self.cols = [deck[:13], deck[13:26], deck[26:39], deck[39:]]
 
-        # Reset other fields to values initialized by constructor
+        # Start with an empty stack and no moves played
         self.stack = []
         self.count = 0
+        self.tail = EMPTY_TAIL
         self.points = 0
         self.history = []
+        self.cleared = None
+        self.position = pack_position(
+            [len(col) for col in self.cols], 0, EMPTY_TAIL)
+
+    def new_stack(self):
+        """Empty the stack and zero the count, when there are no legal
+        moves.
+
+        The old stack is kept in self.cleared until the next move,
+        which saves it in its history entry so that undo_move can put
+        it back.
+        """
+
+        if self.stack:
+            self.cleared = (self.stack, self.count, self.tail,
+                            self.position)
+        self.stack = []
+        self.count = 0
+        self.tail = EMPTY_TAIL
+        self.position = clear_position(self.position)
+
+    def restore_stack(self):
+        """Put back the stack emptied by new_stack, if it was called
+        since the last move."""
+
+        if self.cleared is not None:
+            (self.stack, self.count, self.tail,
+             self.position) = self.cleared
+            self.cleared = None
 
     def legal_moves(self):
         """
@@ -145,8 +209,12 @@ class CribbageSolitaire:
 
         moved = self.cols[i].pop()
 
-        # Append current game state to history list
-        self.history.append((moved, i, self.stack[:], self.count, self.points))
+        # Append what the move changes to the history list. The stack
+        # isn't copied: undo_move just takes the card off it again,
+        # and a stack emptied by new_stack is saved as is
+        self.history.append((moved, i, self.cleared, self.count, self.points,
+                             self.tail, self.position))
+        self.cleared = None
 
         # Make the move
         self.stack.append(moved)
@@ -154,28 +222,44 @@ class CribbageSolitaire:
         # Update stack count
         self.count += rank_count[moved]
 
-        # Update points and return category codes in list of strings
-        points_tup = evaluate(self.stack)
+        # Update points (looked up from the top of the stack) and
+        # return category codes in list of strings
+        points_tup = evaluate_tail(self.tail, moved, self.count)
         self.points += points_tup[0]
+        self.tail = points_tup[2]
+
+        # Update the packed position
+        self.position = move_position(
+            self.position, i, self.count, self.tail)
+
         return points_tup[1]
 
     def undo_move(self):
         """Undo the last move, restoring the previous state."""
 
         if self.history:
+            # A new stack started after the last move goes first
+            self.restore_stack()
+
             undid_move = self.history.pop()
 
-            # Add undid_move card to the column it got moved from and
-            # update stack
+            # Move undid_move card from the stack back to the column it
+            # got moved from
+            self.stack.pop()
             self.cols[undid_move[1]].append(undid_move[0])
-            # I think it might be a little dangerous not to make a copy
-            # of undid_move[2], however undid_move is not going to be
-            # edited again so I think its ok to save efficiency
-            self.stack = undid_move[2][:]
 
-            # Undo affect of undid_move on count and points
+            # Undo affect of undid_move on count and points, and keep
+            # the stack emptied before it (if any) for the next undo
+            self.cleared = undid_move[2]
             self.count = undid_move[3]
             self.points = undid_move[4]
+            self.tail = undid_move[5]
+            self.position = undid_move[6]
+
+    def moves_played(self):
+        """Return the moves of the game so far (column indices)."""
+
+        return [entry[1] for entry in self.history]
 
     def save_moves(self, filename):
         """
@@ -243,6 +327,19 @@ class CribbageSolitaire:
 
         return best_list
 
+    def choose(self, moves):
+        """Return one of a list of equally good moves, at random.
+
+        Without a tie_seed the choice uses the random module. With one,
+        it uses self.rng on the sorted moves, so the same game makes the
+        same choices whatever order the moves were found in.
+        """
+
+        if self.rng is None:
+            return random.choice(moves)
+
+        return self.rng.choice(sorted(moves))
+
     def get_move(self, moves):
         """
         Interactively pick one of a set of legal moves.
@@ -312,36 +409,47 @@ class CribbageSolitaire:
     def autoplay(self, verbose=True, pause=False):
         """Automatically play a game until finished.
 
+        How much is printed depends on self.verbosity (see SILENT,
+        MOVES and BOARD).
+
         Argument:
         - verbose: if `True`, print extra information after a move
         - pause: if `True`, pause after printing move info.
 
-        Return value: none
+        Return value: the final point total
         """
         while not self.game_over():
-            self.dump()
+            if self.verbosity >= BOARD:
+                self.dump()
             moves = self.legal_moves()
-            print(f'MOVES: {moves}')
+            if self.verbosity >= BOARD:
+                print(f'MOVES: {moves}')
             if not moves:
-                print('No moves; starting a new stack...')
+                if self.verbosity >= MOVES:
+                    print('No moves; starting a new stack...')
                 # empty the stack, zero the count
-                self.stack = []
-                self.count = 0
+                self.new_stack()
                 continue
             best = self.best_moves(moves)
-            move = random.choice(best)
-            print(f'MOVE: {move}')
+            move = self.choose(best)
+            if self.verbosity >= MOVES:
+                print(f'MOVE: {move}')
             codes = self.make_move(move)
-            if codes and verbose:
+            if codes and verbose and self.verbosity >= MOVES:
                 print(f'Stack after move: {self.stack}')
                 for code in codes:
                     print(f'+++ {category_codes[code]}')
             if pause:
                 self.pause()
-        self.dump()
-        print(f'TOTAL POINTS: {self.points}')
-        self.win_or_lose()
-        self.save_moves('moves.out')
+        if self.verbosity >= BOARD:
+            self.dump()
+        if self.verbosity >= MOVES:
+            print(f'TOTAL POINTS: {self.points}')
+            self.win_or_lose()
+        if self.verbosity >= BOARD:
+            self.save_moves('moves.out')
+
+        return self.points
 
     def play(self):
         """Interactively play a game until finished."""
@@ -351,8 +459,7 @@ class CribbageSolitaire:
             if not moves:
                 # empty the stack, zero the count
                 print('No moves; starting a new stack...')
-                self.stack = []
-                self.count = 0
+                self.new_stack()
                 self.pause()
                 continue
             move = self.get_move(moves)
@@ -4,106 +4,840 @@ This Module has an autosolver to play the game of Cribbage by
 calculating the maximum points it can get in each outcome, looking
 a specified number of moves ahead.
 
-Calling: python3 final_partC1.py <deckname> <depth>
+Calling:
+python3 final_partC1.py <deckname> <depth> [prune] [reuse] [workers=<n>]
+                        [stats=<file>] [store=<file>] [tt-mb=<n>]
+                        [order=<heuristics>]
 <deckname>: the name of the deck to load for Cribbage
 <depth>: the number of moves to look ahead. More moves makes the
 program slower but more likely to find the maximum possible points.
+If <depth> is "exact", the whole game is solved first and every move
+is an optimal one. If <depth> is a number of milliseconds such as
+"500ms", each move looks as far ahead as it can in that much time.
+prune: if given, skip lines which provably can't beat the best line
+found so far. The moves chosen are the same, but found faster.
+reuse: if given, keep search results from one move to the next instead
+of searching the same positions again.
+workers=<n>: split each search between n processes.
+stats=<file>: write what the search of each move did (positions
+visited, cache hits, time taken...) to file, one JSON line per move
+(see cribbage_stats).
+store=<file>: look the deck up in the solution store in file (see
+cribbage_store) and replay the moves found there, instead of searching
+again. A deck not found is solved and saved there. Ties between
+equally good moves are then broken with a seed made from the deck.
+tt-mb=<n>: keep the results of exact solves and of reuse in tables of
+at most n megabytes (see cribbage_tt), instead of letting them grow.
+order=<heuristics>: the heuristics the pruned search tries moves in
+the order of, most important first, separated by commas: score,
+killer, history and/or count (see
+RecursiveCribbageSolitaire.order_moves), or "none" for column order.
+The default is all four. The moves chosen are the same with any order.
 """
 
 
 from final_partB import *
+from cribbage_stats import *
+from cribbage_store import *
+from cribbage_tt import *
 from functools import reduce
+import concurrent.futures
+import json
+import time
 
 
 DEBUG = False
 
 
+# Depth argument which asks for an exact solve of the whole game.
+EXACT = 'exact'
+
+
+# Optional last arguments which turn on the pruned search and keeping
+# search results between moves.
+PRUNE = 'prune'
+REUSE = 'reuse'
+
+
+# Prefix of an optional argument giving the number of worker processes
+# (e.g. "workers=8").
+WORKERS = 'workers='
+
+
+# Prefix of an optional argument giving a file to write the search
+# stats of every move to (e.g. "stats=stats.jsonl").
+STATS = 'stats='
+
+
+# Prefix of an optional argument giving a solution store file (e.g.
+# "store=solutions.db").
+STORE = 'store='
+
+
+# Prefix of an optional argument giving the memory budget of the
+# tables of search results in megabytes (e.g. "tt-mb=512").
+TT_MB = 'tt-mb='
+
+
+# Prefix of an optional argument giving the move ordering heuristics
+# of the pruned search, most important first (e.g.
+# "order=score,killer"), and the value which turns them all off.
+ORDER = 'order='
+NO_ORDER = 'none'
+
+
+# Move ordering heuristics (see `order_moves`): moves which score
+# points at once, the move which last found a better line at the same
+# depth (killer), moves which have found better lines most often
+# (history), and moves which bring the count closest to 15 or 31.
+SCORE_ORDER = 'score'
+KILLER_ORDER = 'killer'
+HISTORY_ORDER = 'history'
+COUNT_ORDER = 'count'
+ORDERINGS = [SCORE_ORDER, KILLER_ORDER, HISTORY_ORDER, COUNT_ORDER]
+
+
+# Memory budget in megabytes of the table the workers of a parallel
+# search with reuse share, if no tt_megabytes is given.
+DEFAULT_SHARED_MB = 64
+
+
+# Suffix of a depth argument which is a time budget in milliseconds.
+MILLISECONDS = 'ms'
+
+
+class SearchTimeout(Exception):
+    """Exception class raised when a search runs out of time."""
+
+    pass
+
+
 class RecursiveCribbageSolitaire(CribbageSolitaire):
 
-    def __init__(self):
-        CribbageSolitaire.__init__(self)
-        self.point_totals = []
+    def __init__(self, deck=None, seed=None, verbosity=BOARD,
+                 tie_seed=None, tt_megabytes=None):
+        """Initialize this object (see CribbageSolitaire.__init__).
+
+        If tt_megabytes is not None, stored search results are kept in
+        TranspositionTables of at most that many megabytes (see
+        cribbage_tt) instead of dicts, which grow without limit.
+        """
+
+        self.tt_megabytes = tt_megabytes
+
+        # Most points reached by the lines of the last search, by their
+        # first move: column index -> points
+        self.point_totals = {}
+
+        # Set to {} to also count the lines each first move leads to:
+        # column index -> [number of lines, sum of their points]
+        self.leaf_stats = None
+
+        # Set to a SearchStats to also count what each search does; a
+        # new one is started for every move (see cribbage_stats)
+        self.search_stats = None
+
+        # Heuristics the pruned search orders moves by (see
+        # `order_moves`), and what they have learned about the current
+        # move's search: the column which last found a better line at
+        # each depth, and a weight for each column of how often it has
+        # (deeper searches weigh more)
+        self.move_ordering = list(ORDERINGS)
+        self.killers = {}
+        self.cutoff_counts = [0] * 4
+
+        # Number of positions visited by the last search (or solved by
+        # the last exact move), by all the searches of the last
+        # autoplay, and the best point total found so far by a pruned
+        # search
+        self.nodes = 0
+        self.game_nodes = 0
+        self.best_total = 0
+
+        # Seconds taken to choose each move of the last autoplay
+        self.move_seconds = []
+
+        # Time (from time.perf_counter) at which a search gives up, or
+        # None, and the depth of the last search which finished in time
+        self.deadline = None
+        self.completed_depth = 0
+
+        # Results of earlier searches kept between moves, or None:
+        # subtree key (see cribbage_position.subtree_key) of the
+        # position key and the moves looked ahead -> (points gained,
+        # content id of the column of the best move)
+        self.subtree_values = None
+
+        # Worker processes used by parallel_search, and how many
+        self.pool = None
+        self.pool_workers = 0
+
+        # Final point total predicted once the search sees the end of
+        # the game (only used when debugging)
+        self.predicted_points = None
+
+        # Moves to play instead of searching (e.g. found in a
+        # SolutionStore), or None
+        self.plan = None
 
-    def determine_move(self, max_depth, moves):
-        self.point_totals = []
-        chosen_depth = min(max_depth, self.num_cards_left())
-        self.best_moves(moves, 0, chosen_depth)
+        # Exact solve results: position key -> (future points, content
+        # id of the column of the best move, see column_content), set
+        # by set_deck
+        self.solutions = None
+
+        # Content ids of the columns at every height, the ones more
+        # than one column can have left, and the canonical column
+        # heights found so far (see cribbage_position), set by
+        # set_deck
+        self.contents = None
+        self.symmetry = None
+        self.canonical = None
+
+        CribbageSolitaire.__init__(self, deck, seed, verbosity, tie_seed)
+
+    def set_deck(self, deck):
+        """Use a new deck, forgetting any solved positions."""
+
+        CribbageSolitaire.set_deck(self, deck)
+        if isinstance(self.subtree_values, SharedTranspositionTable):
+            self.subtree_values.close()
+        self.plan = None
+        self.solutions = self.new_table(cards_left)
+        self.contents = column_contents(self.cols)
+        self.symmetry = shared_contents(self.contents)
+        self.canonical = {}
+        if self.subtree_values is not None:
+            self.subtree_values = self.new_table(subtree_depth)
+
+    def new_table(self, weight, parts=1):
+        """Return an empty table of search results: a dict, or if
+        self.tt_megabytes is not None, a TranspositionTable with a
+        `parts`-th of that memory, keeping the keys of most weight
+        (see cribbage_tt)."""
+
+        if self.tt_megabytes is None:
+            return {}
+        return TranspositionTable(self.tt_megabytes / parts, weight)
+
+    def determine_move(self, max_depth, moves, prune=False,
+                       time_budget=None, reuse=False, workers=1):
+        """Return the move (column index) to play next.
+
+        Arguments:
+        - max_depth: the number of moves to look ahead, or None to
+          solve the whole game exactly
+        - moves: the legal moves in the current game state
+        - prune: if `True`, skip branches which cannot beat the best
+          line found so far (see `pruned_moves`)
+        - time_budget: if not None, the number of seconds to search
+          for. The search looks 1, 2, 3... moves ahead until time runs
+          out (or max_depth is reached, if it is not None) and uses
+          the deepest search that finished (see `deepening_move`).
+        - reuse: if `True`, keep the results of this search for the
+          next call, so the part of the tree below the move played is
+          not searched again (see self.subtree_values)
+        - workers: the number of processes to split the search between
+          (see `parallel_search`)
+
+        Return value: one of the moves leading to the most points
+        max_depth moves in the future, chosen randomly if there are
+        several. If self.plan holds moves, the next of them is
+        returned without searching.
+        """
+
+        stats = self.search_stats
+
+        if self.plan:
+            self.nodes = 0
+            if stats is not None:
+                self.search_stats = SearchStats()
+                self.search_stats.planned = True
+            return self.plan.pop(0)
+
+        if stats is not None:
+            self.search_stats = stats = SearchStats()
+            stats.start_history = len(self.history)
+            start = time.perf_counter()
+            evictions = self.table_evictions()
+
+        self.killers = {}
+        self.cutoff_counts = [0] * 4
+
+        if not reuse:
+            self.subtree_values = None
+        elif self.subtree_values is None:
+            self.subtree_values = self.new_table(subtree_depth)
+        else:
+            self.forget_other_subtrees()
+
+        if time_budget is not None:
+            move = self.deepening_move(
+                max_depth, moves, prune, time_budget, workers)
+
+        elif max_depth is None:
+            # Exact mode: solve (or look up) this position and play
+            # its optimal move
+            self.nodes = 0
+            self.solve_position()
+            move = self.content_column(
+                self.solutions[self.position_key()][1])
+
+        else:
+            self.nodes = 0
+            chosen_depth = min(max_depth, self.num_cards_left())
+            max_points, max_moves = self.search(
+                moves, chosen_depth, prune, workers=workers)
+
+            # Choose move randomly from moves that get max points
+            move = self.choose(max_moves)
+
+        if stats is not None:
+            stats.seconds = time.perf_counter() - start
+            stats.cache_evictions += self.table_evictions() - evictions
+
+        return move
+
+    def table_evictions(self):
+        """Return the number of entries replaced so far by other keys
+        in the TranspositionTables of self.solutions and
+        self.subtree_values (dicts don't replace any)."""
+
+        return sum(table.evictions
+                   for table in [self.solutions, self.subtree_values]
+                   if isinstance(table, TranspositionTable))
+
+    def search(self, moves, depth, prune=False, lower_bound=0, workers=1):
+        """Search depth moves ahead from the current game state.
+
+        Arguments:
+        - moves: the legal moves in the current game state
+        - depth: the number of moves to look ahead
+        - prune: if `True`, use pruned_moves instead of best_moves
+        - lower_bound: a point total some line of depth moves is known
+          to reach (only used to prune)
+        - workers: if more than 1, split the search between this many
+          processes (see `parallel_search`)
+
+        Return value: a 2-tuple of
+        - the most points that can be reached depth moves ahead
+        - the list of moves which reach them
+        """
+
+        self.point_totals = {}
+        if self.leaf_stats is not None:
+            self.leaf_stats = {}
+
+        stats = self.search_stats
+        if stats is not None:
+            start = time.perf_counter()
+
+        if prune:
+            # Any line the greedy player finds is a score the search
+            # must at least match
+            self.best_total = max(lower_bound, self.greedy_rollout(depth))
+
+        if workers > 1:
+            self.parallel_search(moves, depth, prune, workers)
+        elif prune:
+            self.pruned_moves(moves, 0, depth)
+        else:
+            self.best_moves(moves, 0, depth)
+
+        if stats is not None:
+            stats.depth_seconds[depth] = time.perf_counter() - start
 
         if DEBUG:
             # If debugging, print col # of current move and points
-            # the algorithm expects after chosen_depth turns
-            print(f"Col #: Points after {chosen_depth} turns:")
-            for a in self.point_totals:
-                print(f"{a[0]}      {a[1]}")
+            # the algorithm expects after depth turns
+            print(f"Col #: Points after {depth} turns:")
+            for first_column, this_point_total in self.point_totals.items():
+                print(f"{first_column}      {this_point_total}")
 
         max_points = 0
-        max_indexes = []
-
-        for i in range(len(self.point_totals)):
-            # Find a list of the indices of all maximum possible
-            # points in self.point_totals
-            this_point_total = self.point_totals[i][1]
+        max_moves = []
 
+        for first_column, this_point_total in self.point_totals.items():
+            # Find the first moves of all maximum possible points in
+            # self.point_totals
             if this_point_total > max_points:
                 max_points = this_point_total
-                max_indexes = [i]
+                max_moves = [first_column]
 
             elif this_point_total == max_points:
-                max_indexes.append(i)
+                max_moves.append(first_column)
 
-        if DEBUG:
-            # If debugging, check that the algorithm's predicted
-            # points it will get are the same as what it actually
-            # gets
-            predictive_points = []
-            if self.num_cards_left() <= max_depth:
-                predictive_points.append(max_points)
-            if self.num_cards_left() == 1:
-                for end_points in predictive_points:
-                    assert end_points == self.points
-                    print("Passing end point total asserts...")
+        if DEBUG and depth == self.num_cards_left():
+            # If debugging, check that once the search can see the end
+            # of the game, the points it predicts are the points it
+            # actually gets
+            if self.predicted_points is None:
+                self.predicted_points = max_points
+            assert self.predicted_points == max_points
+            print("Passing end point total asserts...")
+
+        return max_points, max_moves
+
+    def deepening_move(self, max_depth, moves, prune, time_budget,
+                       workers=1):
+        """Return the move to play next, searching 1, 2, 3... moves
+        ahead until time_budget seconds have passed.
+
+        Each search tries the root moves in order of the points they
+        reached in the previous search, and a pruned search starts
+        from the previous search's best total (looking further ahead
+        never loses points). A search which runs out of time is thrown
+        away, and the move is chosen from the deepest one that
+        finished; looking 1 move ahead always finishes.
+
+        Arguments:
+        - max_depth: the most moves to look ahead, or None for no
+          limit other than the end of the game
+        - moves: the legal moves in the current game state
+        - prune: if `True`, use the pruned search
+        - time_budget: the number of seconds to search for
+        - workers: the number of processes to split each search between
+
+        Return value: one of the moves leading to the most points
+        in the deepest finished search, chosen randomly if there are
+        several.
+        """
+
+        deadline = time.perf_counter() + time_budget
+        self.nodes = 0
+
+        last_depth = self.num_cards_left()
+        if max_depth is not None:
+            last_depth = min(max_depth, last_depth)
+
+        # Game state to go back to if a search runs out of time
+        history_length = len(self.history)
+        cleared = self.cleared
+
+        max_points = 0
+        max_moves = moves
+        move_points = {}
+
+        for depth in range(1, last_depth + 1):
+            ordered = sorted(moves, key=lambda move: -move_points.get(move, 0))
+
+            # Only check the clock once there is a move to fall back on
+            if depth > 1:
+                self.deadline = deadline
+
+            try:
+                max_points, max_moves = self.search(
+                    ordered, depth, prune, max_points, workers)
+            except SearchTimeout:
+                self.rewind(history_length, cleared)
+                if self.search_stats is not None:
+                    self.search_stats.timeouts += 1
+                break
+
+            self.completed_depth = depth
+            move_points = dict(self.point_totals)
+
+        self.deadline = None
 
         # Choose move randomly from moves that get max points
-        return self.point_totals[random.choice(max_indexes)][0]
+        return self.choose(max_moves)
+
+    def rewind(self, history_length, cleared):
+        """Undo moves until only history_length are left, then put back
+        the stack if new_stack has emptied it since.
+
+        Arguments:
+        - history_length: the length of self.history to go back to
+        - cleared: self.cleared when the history was that long
+        """
+
+        if self.search_stats is not None:
+            self.search_stats.undo_moves += len(self.history) - history_length
+
+        while len(self.history) > history_length:
+            self.undo_move()
+
+        if self.cleared is not cleared:
+            self.restore_stack()
+            self.cleared = cleared
+
+    def follow(self, moves):
+        """Play a list of moves, starting a new stack whenever there
+        are no legal moves."""
+
+        stats = self.search_stats
+
+        for move in moves:
+            if not self.legal_moves():
+                self.new_stack()
+                if stats is not None:
+                    stats.new_stacks += 1
+            self.make_move(move)
+
+        if stats is not None:
+            stats.make_moves += len(moves)
+            stats.evaluations += len(moves)
+
+    def split_moves(self, moves, depth, pieces):
+        """Split the search depth moves ahead into at least `pieces`
+        independent parts, if possible.
+
+        Each part is a list of the first moves of the lines it covers.
+        It starts as one part per legal move, and every part is made
+        one move longer until there are enough (or the parts are depth
+        moves long).
+
+        The game state is not changed by this method.
+        """
+
+        parts = [[move] for move in moves]
+        history_length = len(self.history)
+        cleared = self.cleared
+
+        while len(parts) < pieces and len(parts[0]) < depth:
+            longer_parts = []
+
+            for part in parts:
+                self.follow(part)
+                next_moves = self.legal_moves()
+                if not next_moves:
+                    self.new_stack()
+                    next_moves = self.legal_moves()
+                    if self.search_stats is not None:
+                        self.search_stats.new_stacks += 1
+                self.rewind(history_length, cleared)
+
+                for move in next_moves:
+                    longer_parts.append(part + [move])
+
+            parts = longer_parts
+
+        return parts
+
+    def worker_copy(self):
+        """Return a copy of the game state which can be sent to a
+        worker process (without the history, stored results or the
+        process pool)."""
 
-    def autoplay(self, max_depth, verbose=True, pause=False):
+        copy = RecursiveCribbageSolitaire.__new__(RecursiveCribbageSolitaire)
+        copy.__dict__.update(self.__dict__)
+
+        copy.cols = [col[:] for col in self.cols]
+        copy.stack = self.stack[:]
+        copy.history = []
+        copy.cleared = None
+        copy.point_totals = {}
+        if self.leaf_stats is not None:
+            copy.leaf_stats = {}
+        copy.solutions = {}
+        copy.canonical = {}
+        if isinstance(self.subtree_values, SharedTranspositionTable):
+            copy.subtree_values = self.subtree_values
+        elif self.subtree_values is not None:
+            copy.subtree_values = self.new_table(
+                subtree_depth, self.pool_workers)
+        if self.search_stats is not None:
+            copy.search_stats = SearchStats()
+        copy.pool = None
+
+        return copy
+
+    def parallel_search(self, moves, depth, prune, workers):
+        """Search depth moves ahead like best_moves (or pruned_moves,
+        starting from self.best_total) using a pool of worker processes.
+
+        The search is cut into parts with split_moves, each part is
+        searched by a worker on its own copy of the game state, and
+        the most points of each part are recorded in self.point_totals
+        under its first move. The pool is kept in self.pool for the
+        next search (see `close_pool`).
+
+        If search results are kept (self.subtree_values is not None),
+        they are kept in a SharedTranspositionTable of self.tt_megabytes
+        (or DEFAULT_SHARED_MB) megabytes, which every worker reads and
+        writes, so no two workers search the same position.
+        """
+
+        if self.pool is None or self.pool_workers != workers:
+            self.close_pool()
+            self.pool = concurrent.futures.ProcessPoolExecutor(workers)
+            self.pool_workers = workers
+
+        if self.subtree_values is not None and not isinstance(
+                self.subtree_values, SharedTranspositionTable):
+            # Keep results in shared memory, so every worker finds the
+            # positions the others have searched (and the counters so
+            # far)
+            table = self.subtree_values
+            self.subtree_values = SharedTranspositionTable(
+                self.tt_megabytes or DEFAULT_SHARED_MB, subtree_depth)
+            if isinstance(table, TranspositionTable):
+                self.subtree_values.add_counters(table.counters())
+
+        parts = self.split_moves(moves, depth, workers)
+        game = self.worker_copy()
+
+        futures = [self.pool.submit(search_part, game, part, depth, prune)
+                   for part in parts]
+
+        try:
+            for part, future in zip(parts, futures):
+                future_points, nodes, leaf_stats, stats, counters = \
+                    future.result()
+                self.nodes += nodes
+                if counters is not None:
+                    self.subtree_values.add_counters(counters)
+                if stats is not None:
+                    self.search_stats.add(stats)
+                if future_points >= 0:
+                    self.record_line(part[0], future_points)
+                if leaf_stats is not None:
+                    stats = self.leaf_stats.setdefault(part[0], [0, 0])
+                    stats[0] += leaf_stats[0]
+                    stats[1] += leaf_stats[1]
+        except SearchTimeout:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def close_pool(self):
+        """Shut down the worker processes of parallel_search, if any,
+        and free the table they shared."""
+
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+        if isinstance(self.subtree_values, SharedTranspositionTable):
+            # The table made in its place keeps the counters, so they
+            # can still be reported
+            shared = self.subtree_values
+            shared.close()
+            self.subtree_values = self.new_table(subtree_depth)
+            if isinstance(self.subtree_values, TranspositionTable):
+                self.subtree_values.add_counters(shared.counters())
+
+    def autoplay(self, max_depth, verbose=True, pause=False, prune=False,
+                 time_budget=None, reuse=False, workers=1, stats_file=None):
         """Automatically play a game until finished, using the
         autosolver that can look max_depth moves ahead.
 
         Argument:
         - verbose: if `True`, print extra information after a move
         - pause: if `True`, pause after printing move info.
+        - prune: if `True`, use the pruned search (see `pruned_moves`)
+        - time_budget: if not None, search each move for this many
+          seconds instead of to a fixed depth (see `deepening_move`)
+        - reuse: if `True`, keep search results from one move to the
+          next (see `determine_move`)
+        - workers: the number of processes to split each search between
+        - stats_file: if not None, the name of a file to write the
+          search stats of every move to (see cribbage_stats), one JSON
+          object per line, with the move number and column added
 
-        Return value: none
+        How much is printed depends on self.verbosity (see SILENT,
+        MOVES and BOARD in final_partB).
+
+        Return value: the final point total
         """
 
+        self.game_nodes = 0
+        self.move_seconds = []
+
+        stats_lines = None
+        if stats_file is not None:
+            self.search_stats = SearchStats()
+            stats_lines = open(stats_file, 'w')
+
         while not self.game_over():
-            self.dump()
+            if self.verbosity >= BOARD:
+                self.dump()
             moves = self.legal_moves()
-            print(f'MOVES: {moves}')
+            if self.verbosity >= BOARD:
+                print(f'MOVES: {moves}')
 
             if not moves:
-                print('No moves; starting a new stack...')
+                if self.verbosity >= MOVES:
+                    print('No moves; starting a new stack...')
                 # empty the stack, zero the count
-                self.stack = []
-                self.count = 0
+                self.new_stack()
                 continue
 
-            move = self.determine_move(max_depth, moves)
+            start = time.perf_counter()
+            move = self.determine_move(
+                max_depth, moves, prune, time_budget, reuse, workers)
+            self.move_seconds.append(time.perf_counter() - start)
+            self.game_nodes += self.nodes
 
-            print(f'MOVE: {move}')
+            if stats_lines is not None:
+                stats_lines.write(json.dumps(
+                    {'move': len(self.history), 'column': move,
+                     'ordering': ','.join(self.move_ordering) or NO_ORDER,
+                     **self.search_stats.as_dict()}) + '\n')
+
+            if self.verbosity >= MOVES:
+                if time_budget is not None and verbose:
+                    print(f'DEPTH: {self.completed_depth}')
+                print(f'MOVE: {move}')
             codes = self.make_move(move)
-            if codes and verbose:
+            if codes and verbose and self.verbosity >= MOVES:
                 print(f'Stack after move: {self.stack}')
                 for code in codes:
                     print(f'+++ {category_codes[code]}')
             if pause:
                 self.pause()
 
-        self.dump()
-        print(f'TOTAL POINTS: {self.points}')
-        self.win_or_lose()
-        self.save_moves('moves.out')
+        if self.verbosity >= BOARD:
+            self.dump()
+        if self.verbosity >= MOVES:
+            print(f'TOTAL POINTS: {self.points}')
+            self.win_or_lose()
+        if self.verbosity >= BOARD:
+            self.save_moves('moves.out')
+        if stats_lines is not None:
+            stats_lines.close()
+
+        self.close_pool()
+
+        if DEBUG and self.predicted_points is not None:
+            assert self.points == self.predicted_points
+
+        return self.points
+
+    def position_key(self):
+        """Return a hashable key for the current position.
+
+        Positions with the same key have the same future points. This
+        is the packed position (see cribbage_position): the deck is
+        fixed, so the column heights say which cards are left, and the
+        count plus the packed `live_tail` say everything about the
+        stack that can still score.
+
+        Which column holds which cards doesn't matter either, so when
+        two columns can have the same cards left, the canonical
+        position is used, and moves are stored in results as the
+        content id of their column (see column_content).
+        """
+
+        if self.symmetry:
+            return canonical_position(self.position, self.contents,
+                                      self.canonical)
+        return self.position
+
+    def column_content(self, col):
+        """Return the content id of the cards left in column col (the
+        same for columns with the same ranks left)."""
+
+        return self.contents[col][len(self.cols[col])]
+
+    def content_column(self, content):
+        """Return the index of a column whose cards left have content
+        id `content`, to play a move stored by position_key."""
+
+        for col in range(4):
+            if self.contents[col][len(self.cols[col])] == content:
+                return col
+
+    def solve_position(self):
+        """Return the most points that can still be gained from the
+        current position, playing perfectly until the game is over.
+
+        Results for every position searched are stored in
+        self.solutions together with the move that achieves them, so
+        positions reached again by a different move order are only
+        solved once. The game state is not changed by this method.
+        """
+
+        if self.game_over():
+            return 0
+
+        key = self.position_key()
+        stats = self.search_stats
+        solution = self.solutions.get(key)
+        if solution is not None:
+            if stats is not None:
+                stats.cache_hits += 1
+            return solution[0]
+
+        self.nodes += 1
+        if stats is not None:
+            stats.visit(len(self.history) - stats.start_history)
+            stats.cache_misses += 1
+        moves = self.legal_moves()
+
+        if not moves:
+            # Start a new stack, solve from there, and put the old
+            # stack back so the state is unchanged
+            cleared = self.cleared
+            self.new_stack()
+            if stats is not None:
+                stats.new_stacks += 1
+            best_points = self.solve_position()
+            best_move = self.solutions[self.position_key()][1]
+            self.rewind(len(self.history), cleared)
+
+        else:
+            best_points = -1
+            best_move = None
+            tried = []
+
+            for col_index in moves:
+                # Columns with the same cards left lead to the same
+                # position, so only one of them is tried
+                content = self.contents[col_index][len(self.cols[col_index])]
+                if content in tried:
+                    continue
+                tried.append(content)
+
+                self.make_move(col_index)
+                gained = self.points - self.history[-1][4]
+                future_points = gained + self.solve_position()
+                self.undo_move()
+
+                if future_points > best_points:
+                    best_points = future_points
+                    best_move = content
+
+            if stats is not None:
+                stats.make_moves += len(tried)
+                stats.evaluations += len(tried)
+                stats.undo_moves += len(tried)
+
+        self.solutions[key] = (best_points, best_move)
+        if stats is not None:
+            stats.cache_stores += 1
+        return best_points
+
+    def solve(self):
+        """Solve the rest of the game exactly.
+
+        Return value: a 2-tuple of
+        - the optimal final point total
+        - a list of moves (column indices) which reaches it
+
+        The game state is not changed by this method.
+        """
+
+        final_points = self.points + self.solve_position()
+
+        # Follow the stored best moves to the end of the game, then
+        # undo them all
+        history_length = len(self.history)
+        cleared = self.cleared
+        moves = []
+
+        while not self.game_over():
+            if not self.legal_moves():
+                self.new_stack()
+            # Solve again in case the position was dropped from a
+            # TranspositionTable
+            self.solve_position()
+            move = self.content_column(self.solutions[self.position_key()][1])
+            moves.append(move)
+            self.make_move(move)
+
+        self.rewind(history_length, cleared)
+
+        return final_points, moves
 
     def num_cards_left(self):
         """Takes no arguments. Returns the number of cards in self.cols."""
@@ -119,32 +853,506 @@ class RecursiveCribbageSolitaire(CribbageSolitaire):
         max_depth - the maximum amount of moves in the future the
         algorithm should consider to make a move
 
-        Appends all possible first moves and the point values they
-        lead to max_depth moves in the future to self.point_totals.
+        Records all possible first moves and the point values they
+        lead to max_depth moves in the future with record_line.
+        If self.subtree_values is not None, positions already searched
+        to the same depth are looked up there instead, and only their
+        best line is recorded.
+
+        Returns the most points reached max_depth moves in the future
+        from the current game state.
         """
 
+        self.nodes += 1
+        stats = self.search_stats
+        if stats is not None:
+            stats.visit(depth)
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise SearchTimeout(f"Ran out of time at depth {max_depth}.")
+
         if depth == max_depth:
-            # For every possible outcome, append the first column
-            # number moved and the future resultant points to storage
+            # For every possible outcome, record the first column
+            # number moved and the future resultant points
             first_column = self.history[-max_depth][1]
-            future_points = self.history[-1][4]
+            future_points = self.points
 
-            self.point_totals.append((first_column, future_points))
+            self.record_line(first_column, future_points)
+            return future_points
 
-        else:
+        key = None
+        if self.subtree_values is not None and depth > 0:
+            key = subtree_key(self.position_key(), max_depth - depth)
+            stored = self.subtree_values.get(key)
+            if stored is not None:
+                if stats is not None:
+                    stats.cache_hits += 1
+                future_points = self.points + stored[0]
+                first_column = self.history[-depth][1]
+                self.record_line(first_column, future_points)
+                return future_points
+            if stats is not None:
+                stats.cache_misses += 1
+
+        if not moves:
+            self.new_stack()
+            moves = self.legal_moves()
+            if stats is not None:
+                stats.new_stacks += 1
+
+        most_points = -1
+        best_move = None
+
+        for col_index in moves:
+            # For every legal move, do the move then see what the
+            # best moves are in this new state, then undo the move
+            # to keep game state the same. Moves are counted one by
+            # one, as a timeout can stop the loop part way
+            if stats is not None:
+                stats.make_moves += 1
+                stats.evaluations += 1
+            self.make_move(col_index)
+            future_points = self.best_moves(
+                self.legal_moves(), depth + 1, max_depth)
+            self.undo_move()
+            if stats is not None:
+                stats.undo_moves += 1
+
+            if future_points > most_points:
+                most_points = future_points
+                best_move = self.column_content(col_index)
+
+        if key is not None:
+            self.subtree_values[key] = (most_points - self.points, best_move)
+
+        if stats is not None and key is not None:
+            stats.cache_stores += 1
+
+        return most_points
+
+    def record_line(self, first_column, future_points):
+        """Record a line of the search starting with the move
+        first_column and reaching future_points points.
+
+        Only the most points of each first move are kept in
+        self.point_totals, so memory doesn't grow with the number of
+        lines. If self.leaf_stats is not None, the number of lines and
+        their total points are also counted (see `leaf_means`).
+        """
 
+        if future_points > self.point_totals.get(first_column, -1):
+            self.point_totals[first_column] = future_points
+
+        if self.leaf_stats is not None:
+            stats = self.leaf_stats.setdefault(first_column, [0, 0])
+            stats[0] += 1
+            stats[1] += future_points
+
+    def leaf_means(self):
+        """Return the mean points of the lines recorded by the last
+        search for each first move (column index -> mean), or None if
+        self.leaf_stats is not being kept."""
+
+        if self.leaf_stats is None:
+            return None
+
+        return {first_column: total / lines
+                for first_column, (lines, total) in self.leaf_stats.items()}
+
+    def order_moves(self, moves, depth):
+        """Return moves in the order the pruned search should try them,
+        by the heuristics in self.move_ordering, most important first
+        (ties keep the column order):
+        - SCORE_ORDER: most points gained by the move itself
+        - KILLER_ORDER: the move which last found a better line at
+          this depth (see pruned_moves)
+        - HISTORY_ORDER: moves which have found better lines most
+          often in this move's search
+        - COUNT_ORDER: moves which bring the count closest below 15 or
+          31
+
+        Trying the best move first makes the pruned search reach a
+        high self.best_total early, so more branches are skipped; the
+        moves chosen are the same in any order.
+        """
+
+        if len(moves) < 2 or not self.move_ordering:
+            return moves
+
+        stats = self.search_stats
+        if stats is not None and SCORE_ORDER in self.move_ordering:
+            stats.evaluations += len(moves)
+
+        keys = {}
+        for col_index in moves:
+            card = self.cols[col_index][-1]
+            count = self.count + rank_count[card]
+            key = []
+
+            for heuristic in self.move_ordering:
+                if heuristic == SCORE_ORDER:
+                    key.append(-evaluate_tail(self.tail, card, count)[0])
+                elif heuristic == KILLER_ORDER:
+                    key.append(col_index != self.killers.get(depth))
+                elif heuristic == HISTORY_ORDER:
+                    key.append(-self.cutoff_counts[col_index])
+                else:
+                    key.append(15 - count if count <= 15 else 31 - count)
+
+            keys[col_index] = key
+
+        return sorted(moves, key=keys.get)
+
+    def ordered_moves(self, moves, position, moves_left):
+        """Return moves with the best move found by an earlier,
+        shallower search of position (in self.subtree_values) first."""
+
+        if self.subtree_values is None:
+            return moves
+
+        for depth_left in range(moves_left - 1, 0, -1):
+            earlier = self.subtree_values.get(
+                subtree_key(position, depth_left))
+            if earlier is not None:
+                best_move = self.content_column(earlier[1])
+                return [best_move] + [m for m in moves if m != best_move]
+
+        return moves
+
+    def forget_other_subtrees(self):
+        """Remove every position from self.subtree_values which can't
+        be reached from the current game state any more (it has more
+        cards left in some column, or with canonical positions, in
+        some column once both are sorted by height).
+
+        A TranspositionTable starts a new generation instead (see
+        cribbage_tt).
+        """
+
+        if isinstance(self.subtree_values, TranspositionTable):
+            # Too big to go through: the entries are kept, but are the
+            # first to be replaced
+            self.subtree_values.new_generation()
+            return
+
+        if not self.subtree_values:
+            return
+
+        stored = len(self.subtree_values)
+        heights = [len(col) for col in self.cols]
+        if self.symmetry:
+            heights.sort()
+
+        def reachable(key):
+            key_heights = unpack_position(key >> DEPTH_BITS)[0]
+            if self.symmetry:
+                key_heights.sort()
+            return all(height <= heights[i]
+                       for i, height in enumerate(key_heights))
+
+        self.subtree_values = {
+            key: value for key, value in self.subtree_values.items()
+            if reachable(key)}
+
+        if self.search_stats is not None:
+            self.search_stats.cache_evictions += \
+                stored - len(self.subtree_values)
+
+    def greedy_rollout(self, max_depth):
+        """Return the points after playing max_depth moves with the
+        greedy one move look ahead of CribbageSolitaire.best_moves,
+        taking the lowest column when there is a tie.
+
+        The game state is not changed by this method.
+        """
+
+        history_length = len(self.history)
+        cleared = self.cleared
+        stats = self.search_stats
+        played = 0
+
+        while played < max_depth and not self.game_over():
+            moves = self.legal_moves()
             if not moves:
-                self.stack = []
-                self.count = 0
-                moves = self.legal_moves()
+                self.new_stack()
+                if stats is not None:
+                    stats.new_stacks += 1
+                continue
 
-            for col_index in moves:
-                # For every legal move, do the move then see what the
-                # best moves are in this new state, then undo the move
-                # to keep game state the same
-                self.make_move(col_index)
-                self.best_moves(self.legal_moves(), depth + 1, max_depth)
-                self.undo_move()
+            self.make_move(CribbageSolitaire.best_moves(self, moves)[0])
+            played += 1
+
+            if stats is not None:
+                # best_moves tries every move when there is a choice
+                tried = len(moves) if len(moves) > 1 else 0
+                stats.make_moves += tried + 1
+                stats.evaluations += tried + 1
+                stats.undo_moves += tried
+
+        points = self.points
+        self.rewind(history_length, cleared)
+
+        return points
+
+    def points_bound(self, moves_left):
+        """Return an upper bound on the points the next moves_left
+        moves can gain from the current position.
+
+        Each move gains at most 2 points for a 15 or 31 count (or an
+        initial jack), plus either a pair or a straight. The bound is
+        the smaller of two estimates of the pair/straight part:
+        - per move: the j-th move can't make a straight longer than the
+          live stack tail plus j cards, and the pair points are at most
+          the best pair points of the cards which can be reached
+        - per card: each card that can be reached within moves_left
+          moves can make at most its best pair or its straight_limit
+        """
+
+        # Cards which can be played within moves_left moves
+        reachable = []
+        for col in self.cols:
+            reachable += col[-moves_left:]
+
+        if not reachable:
+            return 0
+
+        tail_length = len(live_tail(self.stack, self.count))
+
+        # Number of cards of the top rank of the stack which are
+        # already in a row at the top of the stack
+        top_run = 0
+        if tail_length:
+            top_run = 1
+            while top_run < min(3, len(self.stack)) \
+                    and self.stack[-top_run - 1] == self.stack[-1]:
+                top_run += 1
+
+        # Best pair points of each reachable card: the n-th card of a
+        # rank in a row gets n * (n - 1) points
+        pair_bounds = []
+        straight_bounds = []
+        rank_totals = {}
+        for rank in reachable:
+            in_a_row = rank_totals.get(rank, 0) + 1
+            if tail_length and rank == self.stack[-1]:
+                in_a_row += top_run
+            rank_totals[rank] = rank_totals.get(rank, 0) + 1
+            in_a_row = min(in_a_row, 4)
+
+            pair_bounds.append(in_a_row * (in_a_row - 1))
+            straight_bounds.append(straight_limit[rank])
+
+        pair_bounds.sort(reverse=True)
+        moves_left = min(moves_left, len(reachable))
+
+        per_move = 0
+        for j in range(moves_left):
+            straight = min(7, tail_length + j + 1)
+            if straight < 3:
+                straight = 0
+            per_move += max(straight, pair_bounds[j])
+
+        card_bounds = [max(pair_bounds[i], straight_bounds[i])
+                       for i in range(len(reachable))]
+        card_bounds.sort(reverse=True)
+        per_card = sum(card_bounds[:moves_left])
+
+        return 2 * moves_left + min(per_move, per_card)
+
+    def pruned_moves(self, moves, depth, max_depth):
+        """Same as best_moves, but skips every branch which cannot
+        reach self.best_total points max_depth moves in the future.
+
+        self.best_total must be the point total of some line of
+        max_depth moves (e.g. from greedy_rollout); it is raised as
+        better lines are found. Only lines at least as good as the best
+        found so far are recorded, so the best moves are the same as
+        those found by best_moves.
+
+        Return value: a 2-tuple of
+        - an upper bound on the most points reached max_depth moves in
+          the future from the current game state
+        - `True` if that bound is exact (no branch that could have
+          reached it was skipped)
+
+        Only exact results are stored in self.subtree_values.
+        """
+
+        self.nodes += 1
+        stats = self.search_stats
+        if stats is not None:
+            stats.visit(depth)
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise SearchTimeout(f"Ran out of time at depth {max_depth}.")
+
+        if depth == max_depth:
+            if self.points >= self.best_total:
+                self.best_total = self.points
+                first_column = self.history[-max_depth][1]
+                self.record_line(first_column, self.points)
+            return self.points, True
+
+        key = position = None
+        if self.subtree_values is not None:
+            position = self.position_key()
+        if position is not None and depth > 0:
+            key = subtree_key(position, max_depth - depth)
+            stored = self.subtree_values.get(key)
+            if stored is not None:
+                if stats is not None:
+                    stats.cache_hits += 1
+                future_points = self.points + stored[0]
+                if future_points >= self.best_total:
+                    self.best_total = future_points
+                    first_column = self.history[-depth][1]
+                    self.record_line(first_column, future_points)
+                return future_points, True
+            if stats is not None:
+                stats.cache_misses += 1
+
+        bound = self.points + self.points_bound(max_depth - depth)
+        if bound < self.best_total:
+            if stats is not None:
+                stats.pruned += 1
+            return bound, False
+
+        if not moves:
+            self.new_stack()
+            moves = self.legal_moves()
+            if stats is not None:
+                stats.new_stacks += 1
+
+        most_points = -1
+        exact = False
+        best_move = None
+        best_index = 0
+        moves_left = max_depth - depth
+
+        # The last move before the leaves isn't worth ordering: a leaf
+        # is never skipped, whatever the best total
+        if moves_left > 1:
+            moves = self.order_moves(moves, depth)
+        moves = self.ordered_moves(moves, position, moves_left)
+
+        for i, col_index in enumerate(moves):
+            if stats is not None:
+                stats.make_moves += 1
+                stats.evaluations += 1
+            best_total = self.best_total
+            self.make_move(col_index)
+            future_points, future_exact = self.pruned_moves(
+                self.legal_moves(), depth + 1, max_depth)
+            self.undo_move()
+            if stats is not None:
+                stats.undo_moves += 1
+
+            # A move which found a better line raised the total the
+            # other branches are cut against: try it early next time
+            if self.best_total > best_total:
+                self.killers[depth] = col_index
+                self.cutoff_counts[col_index] += moves_left * moves_left
+
+            # The result is exact if the most points are reached by a
+            # branch which was searched all the way
+            if future_points > most_points or \
+                    (future_points == most_points and future_exact):
+                most_points = future_points
+                exact = future_exact
+                best_move = self.column_content(col_index)
+                best_index = i
+
+        if stats is not None and len(moves) > 1:
+            stats.ordered_nodes += 1
+            if best_index == 0:
+                stats.best_first += 1
+
+        if key is not None and exact:
+            self.subtree_values[key] = (most_points - self.points, best_move)
+
+        if stats is not None and key is not None and exact:
+            stats.cache_stores += 1
+
+        return most_points, exact
+
+
+def search_part(game, part, max_depth, prune):
+    """Search one part of a parallel search in a worker process.
+
+    Arguments:
+    - game: a copy of the game state (from worker_copy)
+    - part: the first moves of the lines to search
+    - max_depth: the number of moves to look ahead
+    - prune: if `True`, use pruned_moves, starting from game.best_total
+
+    Return value: a 5-tuple of
+    - the most points reached max_depth moves ahead by a line starting
+      with `part`, or -1 if the pruned search found none as good as
+      game.best_total
+    - the number of positions searched
+    - [number of lines, sum of their points] if game.leaf_stats is
+      being kept, otherwise None
+    - the SearchStats of the part if game.search_stats is being kept,
+      otherwise None
+    - what the part added to the counters of game.subtree_values if
+      it is a TranspositionTable (see TranspositionTable.counters),
+      otherwise None
+    """
+
+    table = game.subtree_values
+    if isinstance(table, TranspositionTable):
+        start_counters = table.counters()
+
+    game.nodes = 0
+    game.follow(part)
+
+    if prune:
+        game.pruned_moves(game.legal_moves(), len(part), max_depth)
+    else:
+        game.best_moves(game.legal_moves(), len(part), max_depth)
+
+    future_points = game.point_totals.get(part[0], -1)
+
+    leaf_stats = None
+    if game.leaf_stats is not None:
+        leaf_stats = game.leaf_stats.get(part[0], [0, 0])
+
+    counters = None
+    if isinstance(table, TranspositionTable):
+        counters = tuple(after - before for after, before
+                         in zip(table.counters(), start_counters))
+
+    return future_points, game.nodes, leaf_stats, game.search_stats, \
+        counters
+
+
+def parse_depth(arg):
+    """Parse a <depth> command line argument: a number of moves to
+    look ahead, EXACT, or a number of milliseconds ending in
+    MILLISECONDS.
+
+    Return value: a 2-tuple of the max_depth and time_budget arguments
+    of `RecursiveCribbageSolitaire.autoplay`
+
+    Raises ValueError if arg is not a number where one is expected,
+    and TypeError if the number is out of range.
+    """
+
+    if arg == EXACT:
+        return None, None
+
+    if arg.endswith(MILLISECONDS):
+        time_budget = int(arg[:-len(MILLISECONDS)]) / 1000
+
+        if time_budget <= 0:
+            raise TypeError(f"Expected a time budget > 0, got {arg}.")
+
+        return None, time_budget
+
+    depth = int(arg)
+
+    if depth < 1:
+        raise TypeError(f"Expected depth >= 1, got {depth}.")
+
+    return depth, None
 
 
 if __name__ == '__main__':
@@ -153,19 +1361,63 @@ if __name__ == '__main__':
 
     args_length = len(args)
 
-    if args_length != 2:
-        print(f"Error: Expected two command line args, got {args_length}.")
+    options = args[2:]
+    workers = 1
+    stats_file = None
+    store_file = None
+
+    for option in options:
+        if option.startswith(WORKERS):
+            try:
+                workers = int(option[len(WORKERS):])
+            except ValueError as e:
+                print(f"Entered number of workers caused an error: {e}")
+                quit(1)
+        elif option.startswith(STATS):
+            stats_file = option[len(STATS):]
+        elif option.startswith(STORE):
+            store_file = option[len(STORE):]
+        elif option.startswith(TT_MB):
+            try:
+                cs.tt_megabytes = float(option[len(TT_MB):])
+            except ValueError as e:
+                print(f"Entered table size caused an error: {e}")
+                quit(1)
+        elif option.startswith(ORDER):
+            ordering = option[len(ORDER):]
+            cs.move_ordering = [] if ordering == NO_ORDER \
+                else ordering.split(',')
+            if any(heuristic not in ORDERINGS
+                   for heuristic in cs.move_ordering):
+                print(f"Error: Expected '{NO_ORDER}' or heuristics from"
+                      f" {ORDERINGS}, got {ordering}.")
+                quit(1)
+
+    if args_length < 2 or any(option not in [PRUNE, REUSE]
+                              and not option.startswith(
+                                  (WORKERS, STATS, STORE, TT_MB, ORDER))
+                              for option in options):
+        print("Error: Expected two command line args and optionally"
+              f" '{PRUNE}', '{REUSE}', '{WORKERS}<n>', '{STATS}<file>',"
+              f" '{STORE}<file>', '{TT_MB}<n>' and/or '{ORDER}<heuristics>',"
+              f" got {args}.")
         quit(1)
 
+    if workers < 1:
+        raise TypeError(f"Expected workers >= 1, got {workers}.")
+
+    if cs.tt_megabytes is not None and cs.tt_megabytes <= 0:
+        raise TypeError(f"Expected a table size > 0, got {cs.tt_megabytes}.")
+
+    prune = PRUNE in options
+    reuse = REUSE in options
+
     try:
-        depth = int(args[1])
+        depth, time_budget = parse_depth(args[1])
     except ValueError as e:
         print(f"Entered depth caused an error: {e}")
         quit(1)
 
-    if depth < 1:
-        raise TypeError(f"Expected depth >= 1, got {depth}.")
-
     try:
         cs.load(args[0])
     # No matter the type of exception, the only specificity on
@@ -174,4 +1426,37 @@ if __name__ == '__main__':
         print(f"Entered filename caused an error: {e}")
         quit(1)
 
-    cs.autoplay(depth)
+    store = settings = solution = None
+
+    if store_file is not None:
+        deck = [rank for col in cs.cols for rank in col]
+        cs.rng = random.Random(' '.join(deck))
+        settings = solver_settings(depth, time_budget, prune, reuse)
+
+        try:
+            store = SolutionStore(store_file)
+            if settings is not None:
+                solution = store.get(deck, settings)
+        except sqlite3.Error as e:
+            print(f"Entered solution store caused an error: {e}")
+            quit(1)
+
+        if solution is not None:
+            cs.plan = solution['moves']
+
+    cs.autoplay(depth, prune=prune, time_budget=time_budget, reuse=reuse,
+                workers=workers, stats_file=stats_file)
+
+    if cs.tt_megabytes is not None:
+        table = cs.solutions if depth is None else cs.subtree_values
+        if isinstance(table, TranspositionTable):
+            print(f"Table: {table.stores} entries stored,"
+                  f" {table.hit_rate():.1%} of lookups hit,"
+                  f" {table.evictions} evictions.")
+
+    if store is not None:
+        if solution is None and settings is not None:
+            store.put(deck, settings, cs.points, cs.moves_played(),
+                      {'nodes': cs.game_nodes,
+                       'seconds': round(sum(cs.move_seconds), 4)})
+        store.close()